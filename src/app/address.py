@@ -0,0 +1,134 @@
+"""Normalization of raw accident addresses to canonical country_town entries.
+
+Every known raw (country, town) spelling, the 台/臺 variants and the names before the 2010
+county to city mergers, is stored once with its canonical name and code in the address_alias
+table, so patching addresses is a join, or a cached dictionary hit per distinct pair.
+"""
+from itertools import product
+from .database.utils import session_scope, copy_temp_table
+
+
+# county before the 2010 mergers of the cities
+MERGED_COUNTIES = {
+    '臺中市': '臺中縣',
+    '臺南市': '臺南縣',
+    '高雄市': '高雄縣',
+    '桃園市': '桃園縣',
+    '新北市': '臺北縣',
+}
+
+# suffixes of the towns of the merged counties, all became 區
+MERGED_TOWN_SUFFIXES = ('市', '鎮', '鄉', '區')
+
+CANONICAL_ADDRESS_SQL = """
+SELECT DISTINCT ON (country, town) country, town, code
+FROM country_town
+WHERE code IS NOT NULL
+ORDER BY country, town, code
+"""
+
+RAW_ADDRESS_SQL = """
+SELECT DISTINCT country, town FROM accident
+"""
+
+INSERT_ALIAS_SQL = """
+INSERT INTO address_alias (id, raw_country, raw_town, country, town, code)
+SELECT nextval('address_alias_id_seq'), raw_country, raw_town, country, town, code
+FROM alias
+"""
+
+ALIAS_SQL = """
+SELECT raw_country, raw_town, country, town, code FROM address_alias
+"""
+
+_lookup = None
+_canonical = None
+
+
+def country_town_old_to_new(country, town):
+    country = country.replace('台', '臺')
+    town = town.replace('台', '臺')
+    if country in ('臺中縣', '臺南縣', '高雄縣', '桃園縣'):
+        return country.replace('縣', '市'), town[:-1] + '區'
+    if country == '臺北縣':
+        return '新北市', town[:-1] + '區'
+    return country, town
+
+
+def _spellings(name):
+    return {name, name.replace('臺', '台')}
+
+
+def raw_spellings(country, town):
+    """Yield the raw (country, town) spellings normalized to a canonical country and town."""
+    countries = [(country, town)]
+    if country in MERGED_COUNTIES and town.endswith('區'):
+        countries += [(MERGED_COUNTIES[country], town[:-1] + suffix) for suffix in MERGED_TOWN_SUFFIXES]
+    for old_country, old_town in countries:
+        yield from product(_spellings(old_country), _spellings(old_town))
+
+
+def address_aliases(canonical, raw_pairs=()):
+    """Return {(raw country, raw town): (country, town, code)}.
+
+    Aliases are generated from the canonical entries with the conversion rules, and the observed
+    raw pairs are added when they normalize to a canonical entry.
+    """
+    codes = {(country, town): code for country, town, code in canonical}
+    aliases = dict()
+    for (country, town), code in codes.items():
+        for raw in raw_spellings(country, town):
+            if country_town_old_to_new(*raw) == (country, town):
+                aliases[raw] = (country, town, code)
+    for raw in raw_pairs:
+        normalized = country_town_old_to_new(*raw)
+        if raw not in aliases and normalized in codes:
+            aliases[raw] = (*normalized, codes[normalized])
+    return aliases
+
+
+def build_address_aliases(session):
+    """Rebuild the address_alias table from country_town and the raw addresses of accident."""
+    global _lookup, _canonical
+    canonical = session.execute(CANONICAL_ADDRESS_SQL).fetchall()
+    raw_pairs = [tuple(pair) for pair in session.execute(RAW_ADDRESS_SQL)]
+    aliases = address_aliases(canonical, raw_pairs)
+    session.execute('DELETE FROM address_alias')
+    copy_temp_table(
+        session, 'alias',
+        'raw_country VARCHAR(30), raw_town VARCHAR(30), country VARCHAR(30), town VARCHAR(30), code VARCHAR(8)',
+        [(*raw, *entry) for raw, entry in aliases.items()]
+    )
+    session.execute(INSERT_ALIAS_SQL)
+    _lookup = _canonical = None
+    print(f'Build address aliases, count: {len(aliases)}.')
+    return len(aliases)
+
+
+def ensure_address_aliases(session):
+    """Build the address_alias table when it is empty, e.g. on the first transform after init."""
+    if session.execute('SELECT 1 FROM address_alias LIMIT 1').first() is None:
+        build_address_aliases(session)
+
+
+def lookup_address(country, town, db='default'):
+    """Return the canonical (country, town, code) of a raw address, or None.
+
+    The alias table is read once per process, spellings missing from it are normalized with the
+    conversion rules and cached.
+    """
+    global _lookup, _canonical
+    if _lookup is None:
+        with session_scope(db) as s:
+            ensure_address_aliases(s)
+            _lookup = {
+                (raw_country, raw_town): (country, town, code)
+                for raw_country, raw_town, country, town, code in s.execute(ALIAS_SQL)
+            }
+            _canonical = {(country, town): code for country, town, code in s.execute(CANONICAL_ADDRESS_SQL)}
+    key = (country, town)
+    if key not in _lookup:
+        normalized = country_town_old_to_new(country, town)
+        code = _canonical.get(normalized)
+        _lookup[key] = (*normalized, code) if code else None
+    return _lookup[key]
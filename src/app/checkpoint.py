@@ -0,0 +1,105 @@
+from datetime import datetime
+from sqlalchemy import or_
+from .database.utils import session_scope, keyset_chunks
+from .database.models import TransformCheckpoint
+
+
+def get_checkpoint(session, step):
+    return session.query(TransformCheckpoint).filter_by(step=step).one_or_none()
+
+
+def mark_running(session, step, reset=False):
+    """Record a step as running, a reset restarts the progress of a step which was not left running."""
+    now = datetime.now()
+    checkpoint = get_checkpoint(session, step)
+    if checkpoint is None:
+        checkpoint = TransformCheckpoint(step=step, status='running')
+        session.add(checkpoint)
+        reset = True
+    elif checkpoint.status != 'running':
+        reset = True
+    if reset:
+        checkpoint.status = 'running'
+        checkpoint.last_id = None
+        checkpoint.rows = 0
+        checkpoint.started_at = now
+        checkpoint.finished_at = None
+    checkpoint.updated_at = now
+    session.flush()
+    return checkpoint
+
+
+def mark_finished(session, step, rows=None):
+    now = datetime.now()
+    checkpoint = mark_running(session, step)
+    checkpoint.status = 'finished'
+    if rows is not None:
+        checkpoint.rows = rows
+    checkpoint.finished_at = now
+    checkpoint.updated_at = now
+
+
+def reset_checkpoints(steps):
+    """Forget the progress of steps and their chunk checkpoints, named '{step}.{table}'."""
+    with session_scope() as s:
+        s.query(TransformCheckpoint).filter(or_(*(
+            or_(TransformCheckpoint.step == step, TransformCheckpoint.step.like(f'{step}.%'))
+            for step in steps
+        ))).delete(synchronize_session=False)
+
+
+def checkpointed_chunks(session, name, query, key, chunk=1000, stream=False):
+    """Iterate keyset chunks of a query, committing each chunk together with its checkpoint.
+
+    A checkpoint left running by an interrupted run is resumed after its last id. A finished one
+    is skipped while its step, the name prefix before the dot, is running and starts over
+    otherwise. The server side cursor of stream=True does not survive commits, streamed chunks
+    are flushed and committed once at the end.
+    """
+    checkpoint = get_checkpoint(session, name)
+    step = get_checkpoint(session, name.split('.')[0])
+    if checkpoint and checkpoint.status == 'finished' and step and step.status == 'running':
+        # finished by the interrupted run of the step being resumed
+        print(f'Skip {name}, finished at {checkpoint.finished_at:%Y-%m-%d %H:%M:%S}.')
+        return
+    checkpoint = mark_running(session, name)
+    last_id, rows = checkpoint.last_id, checkpoint.rows
+    session.commit()
+    if last_id is not None:
+        print(f'Resume {name} after id {last_id}, {rows} rows done.')
+        query = query.filter(key > last_id)
+    for instances in keyset_chunks(query, key, chunk, stream):
+        yield instances
+        last_id = getattr(instances[-1], key.key)
+        rows += len(instances)
+        session.query(TransformCheckpoint).filter_by(step=name).update({
+            TransformCheckpoint.last_id: last_id,
+            TransformCheckpoint.rows: rows,
+            TransformCheckpoint.updated_at: datetime.now(),
+        }, synchronize_session=False)
+        if stream:
+            session.flush()
+        else:
+            session.commit()
+    mark_finished(session, name)
+    session.commit()
+
+
+def run_step(step, function, resume=False, **options):
+    """Run a transform step once, resumed runs skip the steps finished by the previous run.
+
+    Returns the row count of the step, or None when skipped.
+    """
+    with session_scope() as s:
+        checkpoint = get_checkpoint(s, step)
+        if resume and checkpoint and checkpoint.status == 'finished':
+            print(f'Skip {step}, finished at {checkpoint.finished_at:%Y-%m-%d %H:%M:%S}.')
+            return None
+    if not resume:
+        reset_checkpoints([step])
+    with session_scope() as s:
+        mark_running(s, step)
+    rows = function(**options)
+    with session_scope() as s:
+        mark_finished(s, step, rows if isinstance(rows, int) else None)
+    return rows
@@ -1,3 +1,4 @@
+from urllib.parse import urlencode
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
@@ -12,28 +13,60 @@ def get_connection_string(engine, user, password, host, port, name, **options):
     conn = None
     if engine == 'postgresql':
         conn = f"postgresql://{user}:{password}@{host}:{port}/{name}"
-    if options:
-        conn += '?'
-        for key, value in options.items():
-            conn += f'{key}={value}'
     if not conn:
         raise NotImplementedError('Engine type not supported.')
+    if options:
+        conn += '?' + urlencode(options)
     return conn
 
 
-for db, settings in settings.DATABASES.items():
+def get_engine_config(config):
+    """Return create_engine keyword arguments of a DATABASES entry, keys left out keep the defaults."""
     extra_config = dict()
-    connection_string = get_connection_string(
-        engine=settings['ENGINE'],
-        host=settings['HOST'],
-        name=settings['NAME'],
-        port=settings['PORT'],
-        user=settings['USER'],
-        password=settings['PASSWORD'],
-        **settings['OPTIONS']
-    )
-    engine = create_engine(connection_string, **extra_config)
-    session = scoped_session(sessionmaker())
-    session.configure(bind=engine)
-    _engines[db] = engine
-    _sessions[db] = session
+    for key, argument in [('POOL_SIZE', 'pool_size'), ('MAX_OVERFLOW', 'max_overflow'),
+                          ('POOL_PRE_PING', 'pool_pre_ping'), ('POOL_RECYCLE', 'pool_recycle')]:
+        if key in config:
+            extra_config[argument] = config[key]
+    mode = config.get('EXECUTEMANY_MODE')
+    if mode:
+        extra_config['executemany_mode'] = mode
+        if 'EXECUTEMANY_PAGE_SIZE' in config:
+            extra_config[f'executemany_{mode}_page_size'] = config['EXECUTEMANY_PAGE_SIZE']
+    if config.get('STREAM_RESULTS'):
+        extra_config['execution_options'] = {'stream_results': True}
+    connect_args = dict()
+    if config.get('APPLICATION_NAME'):
+        connect_args['application_name'] = config['APPLICATION_NAME']
+    if config.get('STATEMENT_TIMEOUT'):
+        connect_args['options'] = f"-c statement_timeout={config['STATEMENT_TIMEOUT']}"
+    if connect_args:
+        extra_config['connect_args'] = connect_args
+    return extra_config
+
+
+def get_engine(db='default'):
+    """Return the engine of a database declared in settings, created on first use."""
+    engine = _engines.get(db)
+    if engine is None:
+        config = settings.DATABASES[db]
+        connection_string = get_connection_string(
+            engine=config['ENGINE'],
+            host=config['HOST'],
+            name=config['NAME'],
+            port=config['PORT'],
+            user=config['USER'],
+            password=config['PASSWORD'],
+            **config['OPTIONS']
+        )
+        engine = _engines[db] = create_engine(connection_string, **get_engine_config(config))
+    return engine
+
+
+def get_session(db='default'):
+    """Return the scoped session factory of a database, bound to its engine on first use."""
+    session = _sessions.get(db)
+    if session is None:
+        session = scoped_session(sessionmaker())
+        session.configure(bind=get_engine(db))
+        _sessions[db] = session
+    return session
@@ -6,23 +6,74 @@ from sqlalchemy import (
     Date,
     Boolean,
     Float,
-    UniqueConstraint
+    BigInteger,
+    DateTime,
+    UniqueConstraint,
+    Index,
+    text
 )
 from . import _base
 
 
+class LoadManifest(_base):
+    __tablename__ = 'load_manifest'
+    id = Column(Integer, Sequence('load_manifest_id_seq'), primary_key=True, nullable=False)
+    path = Column(Unicode(length=255), nullable=False)
+    table_name = Column(Unicode(length=30), nullable=False)
+    sheet = Column(Integer, nullable=False)
+    size = Column(BigInteger)
+    mtime = Column(Float)
+    content_hash = Column(Unicode(length=64))
+    status = Column(Unicode(length=10), nullable=False)
+    loaded = Column(Integer)
+    rejected = Column(Integer)
+    updated_at = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint('path', 'table_name', 'sheet', name='load_manifest_unique_constraint'),
+     )
+
+
+class TransformCheckpoint(_base):
+    __tablename__ = 'transform_checkpoint'
+    id = Column(Integer, Sequence('transform_checkpoint_id_seq'), primary_key=True, nullable=False)
+    step = Column(Unicode(length=50), nullable=False, unique=True)
+    status = Column(Unicode(length=10), nullable=False)
+    last_id = Column(Integer)
+    rows = Column(Integer)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+
 class CountryTown(_base):
     __tablename__ = 'country_town'
     id = Column(Integer, Sequence('country_town_id_seq'), primary_key=True, nullable=False)
     country = Column(Unicode(length=30), nullable=False)
     town = Column(Unicode(length=30), nullable=False)
     code = Column(Unicode(length=8))
+    source_file_id = Column(Integer, index=True)
 
     __table_args__ = (
         UniqueConstraint('country', 'town', 'code', name='country_town_unique_constraint'),
      )
 
 
+class AddressAlias(_base):
+    """Raw (country, town) spellings of accident addresses and their canonical country_town entry."""
+    __tablename__ = 'address_alias'
+    id = Column(Integer, Sequence('address_alias_id_seq'), primary_key=True, nullable=False)
+    raw_country = Column(Unicode(length=30), nullable=False)
+    raw_town = Column(Unicode(length=30), nullable=False)
+    country = Column(Unicode(length=30), nullable=False)
+    town = Column(Unicode(length=30), nullable=False)
+    code = Column(Unicode(length=8), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('raw_country', 'raw_town', name='address_alias_unique_constraint'),
+     )
+
+
 class Violation(_base):
     __tablename__ = 'violation'
     id = Column(Integer, Sequence('violate_id_seq'), primary_key=True, nullable=False)
@@ -36,6 +87,16 @@ class Violation(_base):
     # one to one relationships
     accident_id = Column(Integer)
 
+    source_file_id = Column(Integer, index=True)
+
+    # post_load indexes are built by `init --post-load` after the bulk load, see utils.create_post_load_indexes
+    __table_args__ = (
+        Index('violation_uid_date_idx', 'uid', 'date', info={'post_load': True}),
+        Index('violation_unmatched_uid_date_idx', 'uid', 'date', postgresql_where=text('accident_id IS NULL'),
+              info={'post_load': True}),
+        Index('violation_accident_id_idx', 'accident_id', info={'post_load': True}),
+    )
+
 
 class Accident(_base):
     __tablename__ = 'accident'
@@ -69,8 +130,14 @@ class Accident(_base):
     # one to one relationships
     violation_id = Column(Integer)
 
+    source_file_id = Column(Integer, index=True)
+
+    # (uid, date) lookups of all accidents are served by the unique constraint
     __table_args__ = (
         UniqueConstraint('uid', 'date', 'hour', name='accident_unique_constraint'),
+        Index('accident_unmatched_uid_date_idx', 'uid', 'date', postgresql_where=text('violation_id IS NULL'),
+              info={'post_load': True}),
+        Index('accident_violation_id_idx', 'violation_id', info={'post_load': True}),
      )
 
 
@@ -80,6 +147,11 @@ class Divorce(_base):
     address_code = Column(Unicode(length=8))
     year = Column(Integer, nullable=False)
     rate = Column(Float, nullable=False)
+    source_file_id = Column(Integer, index=True)
+
+    __table_args__ = (
+        Index('divorce_address_code_year_idx', 'address_code', 'year'),
+     )
 
 
 class Old(_base):
@@ -88,6 +160,11 @@ class Old(_base):
     address_code = Column(Unicode(length=8))
     year = Column(Integer, nullable=False)
     rate = Column(Float, nullable=False)
+    source_file_id = Column(Integer, index=True)
+
+    __table_args__ = (
+        Index('old_address_code_year_idx', 'address_code', 'year'),
+     )
 
 
 class Indigenous(_base):
@@ -96,6 +173,11 @@ class Indigenous(_base):
     address_code = Column(Unicode(length=8))
     year = Column(Integer, nullable=False)
     rate = Column(Float, nullable=False)
+    source_file_id = Column(Integer, index=True)
+
+    __table_args__ = (
+        Index('indigenous_address_code_year_idx', 'address_code', 'year'),
+     )
 
 
 class Education(_base):
@@ -104,6 +186,11 @@ class Education(_base):
     address_code = Column(Unicode(length=8))
     year = Column(Integer, nullable=False)
     rate = Column(Float, nullable=False)
+    source_file_id = Column(Integer, index=True)
+
+    __table_args__ = (
+        Index('education_address_code_year_idx', 'address_code', 'year'),
+     )
 
 
 class IncomeMid(_base):
@@ -112,6 +199,11 @@ class IncomeMid(_base):
     address_code = Column(Unicode(length=8))
     year = Column(Integer, nullable=False)
     rate = Column(Float, nullable=False)
+    source_file_id = Column(Integer, index=True)
+
+    __table_args__ = (
+        Index('income_mid_address_code_year_idx', 'address_code', 'year'),
+     )
 
 
 class IncomeAvg(_base):
@@ -120,3 +212,26 @@ class IncomeAvg(_base):
     address_code = Column(Unicode(length=8))
     year = Column(Integer, nullable=False)
     rate = Column(Float, nullable=False)
+    source_file_id = Column(Integer, index=True)
+
+    __table_args__ = (
+        Index('income_avg_address_code_year_idx', 'address_code', 'year'),
+     )
+
+
+class RegionIndicator(_base):
+    """All region rates of an address code and year in one row, see loader.load_region_indicator."""
+    __tablename__ = 'region_indicator'
+    id = Column(Integer, Sequence('region_indicator_id_seq'), primary_key=True, nullable=False)
+    address_code = Column(Unicode(length=8), nullable=False)
+    year = Column(Integer, nullable=False)
+    divorce = Column(Float)
+    old = Column(Float)
+    indigenous = Column(Float)
+    education = Column(Float)
+    income_mid = Column(Float)
+    income_avg = Column(Float)
+
+    __table_args__ = (
+        UniqueConstraint('address_code', 'year', name='region_indicator_unique_constraint'),
+     )
@@ -1,12 +1,12 @@
 import unittest
 
-from . import _sessions
+from . import get_session
 
 
 class ModelTest(unittest.TestCase):
 
     def setUp(self):
-        self.scoped_session = _sessions.get('default')
+        self.scoped_session = get_session('default')
         self.session = self.scoped_session()
 
     def tearDown(self):
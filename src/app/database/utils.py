@@ -1,6 +1,10 @@
+import io
+import csv
 import sqlalchemy
 from contextlib import contextmanager
-from . import _base, _engines, _sessions
+from more_itertools import chunked
+from . import _base, _engines, get_engine, get_session
+from ..instrument import profiler
 # The models module need to be import before create_all
 from .models import *
 
@@ -8,13 +12,30 @@ from .models import *
 __all__ = [
     'session_scope',
     'init_database',
-    'describe_table'
+    'describe_table',
+    'copy_rows',
+    'dispose_engines',
+    'keyset_chunks',
+    'copy_temp_table',
+    'post_load_indexes',
+    'create_post_load_indexes',
+    'PARTITIONED_TABLES',
+    'partitioned_table'
 ]
 
+# tables optionally range partitioned by year of their date column, see app.partition
+PARTITIONED_TABLES = ('accident', 'violation')
+
+# relkind of existing tables, 'p' for partitioned and 'r' for plain tables
+RELKIND_SQL = """
+SELECT relname, relkind FROM pg_class
+WHERE relnamespace = current_schema()::regnamespace AND relname = ANY(:tables)
+"""
+
 
 @contextmanager
 def session_scope(db='default'):
-    session = _sessions.get(db)()
+    session = get_session(db)()
     try:
         yield session
         session.commit()
@@ -25,15 +46,101 @@ def session_scope(db='default'):
         session.close()
 
 
-def init_database(db='default', drop_all=False):
-    engine = _engines.get(db)
+def keyset_chunks(query, key, chunk=1000, stream=False):
+    """Iterate a query in lists of rows ordered by key, each row is visited exactly once.
+
+    By default every chunk is a `WHERE key > last_key ORDER BY key LIMIT chunk` query, so rows
+    updated while iterating and sparse keys are handled without counting the table first.
+    With stream=True the query is run once through a server side cursor instead.
+    """
+    query = query.order_by(key)
+    if stream:
+        yield from chunked(query.yield_per(chunk), chunk)
+        return
+    last_key = None
+    while True:
+        qs = query if last_key is None else query.filter(key > last_key)
+        rows = qs.limit(chunk).all()
+        if not rows:
+            break
+        yield rows
+        last_key = getattr(rows[-1], key.key)
+
+
+def post_load_indexes():
+    return [
+        index for table in _base.metadata.sorted_tables for index in table.indexes
+        if index.info.get('post_load')
+    ]
+
+
+def partitioned_table(table):
+    """Return a copy of a table range partitioned by date, its primary key includes the partition key."""
+    partitioned = table.tometadata(sqlalchemy.MetaData())
+    partitioned.c.date.primary_key = True
+    partitioned.append_constraint(sqlalchemy.PrimaryKeyConstraint(partitioned.c.id, partitioned.c.date))
+    partitioned.dialect_options['postgresql']['partition_by'] = 'RANGE (date)'
+    return partitioned
+
+
+def init_database(db='default', drop_all=False, partition_by_year=False):
+    """Create the tables, without the post load indexes so bulk loads do not maintain them.
+
+    With partition_by_year the PARTITIONED_TABLES are created as partitioned tables, their
+    yearly partitions are added by the loaders. Raise ValueError when they already exist as
+    plain tables, they have to be dropped first.
+    """
+    engine = get_engine(db)
     if drop_all:
+        # the analytical export view of app.export depends on the tables
+        engine.execute('DROP MATERIALIZED VIEW IF EXISTS accident_export')
         _base.metadata.drop_all(engine)
-    _base.metadata.create_all(engine)
+    if partition_by_year:
+        plain = [
+            name for name, relkind in engine.execute(sqlalchemy.text(RELKIND_SQL), tables=list(PARTITIONED_TABLES))
+            if relkind != 'p'
+        ]
+        if plain:
+            raise ValueError(f"Tables {', '.join(sorted(plain))} exist unpartitioned, drop them to partition by year.")
+    deferred = post_load_indexes()
+    for index in deferred:
+        index.table.indexes.discard(index)
+    try:
+        tables = _base.metadata.sorted_tables
+        if partition_by_year:
+            tables = [table for table in tables if table.name not in PARTITIONED_TABLES]
+            for table in PARTITIONED_TABLES:
+                partitioned_table(_base.metadata.tables[table]).create(engine, checkfirst=True)
+        _base.metadata.create_all(engine, tables=tables)
+    finally:
+        for index in deferred:
+            index.table.indexes.add(index)
+
+
+def create_post_load_indexes(db='default'):
+    """Build the missing post load indexes and refresh the planner statistics of their tables."""
+    engine = get_engine(db)
+    existing = {name for name, in engine.execute('SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()')}
+    tables = []
+    for index in post_load_indexes():
+        if index.table.name not in tables:
+            tables.append(index.table.name)
+        if index.name in existing:
+            continue
+        index.create(engine)
+        print(f'Create index {index.name}.')
+    for table in tables:
+        engine.execute(f'ANALYZE {table}')
+
+
+def dispose_engines():
+    """Close pooled connections of the engines created so far, call it before forking worker processes."""
+    for engine in _engines.values():
+        engine.dispose()
 
 
 def describe_table(table, db='default'):
-    engine = _engines.get(db)
+    engine = get_engine(db)
     assert engine.has_table(table), "Table not exists"
     inspect = sqlalchemy.inspect(engine)
     return {
@@ -45,3 +152,74 @@ def describe_table(table, db='default'):
         'primary_keys': inspect.get_primary_keys(table),
         'table_comment': inspect.get_table_comment(table),
     }
+
+
+def copy_rows(model_class, columns, rows, db='default', extra=None, partition=None):
+    """Stream tuples into the model table with COPY FROM STDIN in one transaction.
+
+    Primary keys are allocated from the table sequence with one query per call, columns
+    having scalar python side defaults are filled in and extra maps columns to a value
+    shared by every row. Rows are copied into the named partition of the table when given.
+    """
+    if not rows:
+        return
+    table = model_class.__table__
+    columns = tuple(columns)
+    if extra:
+        columns += tuple(extra.keys())
+        extra_values = tuple(extra.values())
+        rows = [row + extra_values for row in rows]
+    defaults = tuple(
+        column for column in table.columns
+        if column.name not in columns and getattr(column.default, 'is_scalar', False)
+    )
+    if defaults:
+        columns += tuple(column.name for column in defaults)
+        default_values = tuple(column.default.arg for column in defaults)
+        rows = [row + default_values for row in rows]
+
+    engine = get_engine(db)
+    preparer = engine.dialect.identifier_preparer
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        sequence = table.c.id.default if 'id' in table.c and 'id' not in columns else None
+        if isinstance(sequence, sqlalchemy.Sequence):
+            cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)', (sequence.name, len(rows)))
+            rows = [(pk, *row) for (pk, ), row in zip(cursor.fetchall(), rows)]
+            columns = ('id', ) + columns
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        sql = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            preparer.quote(partition) if partition else preparer.format_table(table),
+            ', '.join(preparer.quote(column) for column in columns)
+        )
+        cursor.copy_expert(sql, buffer)
+        cursor.close()
+        connection.commit()
+        # raw connection statements are not seen by the engine events
+        profiler.add(statements=3 if isinstance(sequence, sqlalchemy.Sequence) else 2, rows_touched=len(rows))
+    except:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def copy_temp_table(session, name, columns, rows):
+    """Create a temporary table dropped on commit and fill it with COPY in the session transaction.
+
+    Columns is the column definition, e.g. 'id INTEGER PRIMARY KEY, uid VARCHAR(30)'.
+    """
+    session.execute(f'CREATE TEMP TABLE {name} ({columns}) ON COMMIT DROP')
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {name} FROM STDIN WITH (FORMAT csv)', buffer)
+        profiler.add(statements=1, rows_touched=cursor.rowcount)
+    finally:
+        cursor.close()
@@ -0,0 +1,147 @@
+"""Analytical export of accidents joined with their violation and the region rates.
+
+The join is precomputed into the accident_export materialized view. The accident year is stored
+as an integer, so the joins on (address_code, year) are served by the composite indexes of the
+rate tables instead of comparing EXTRACT(year ...) doubles with a sequential scan. The view is
+written out with COPY TO, PostgreSQL streams the CSV and nothing goes through the ORM.
+"""
+import os
+from .database import get_engine
+from .database.utils import session_scope
+from .instrument import profiler
+
+
+EXPORT_VIEW = 'accident_export'
+
+RATE_TABLES = ['divorce', 'old', 'indigenous', 'education', 'income_mid', 'income_avg']
+
+ACCIDENT_EXPORT_COLUMNS = [
+    'date', 'hour', 'dead', 'injured', 'party_no', 'gender_no', 'uid', 'driver_birthday', 'birthday', 'country',
+    'town', 'party_address_code', 'party_country', 'party_town', 'car_type', 'injury_level', 'driver_level',
+    'drunk_level', 'hit_and_run', 'job', 'cause_type', 'age', 'age_group',
+]
+
+EXPORT_SELECT_SQL = """
+WITH accident_year AS (
+    SELECT accident.*, CAST(EXTRACT(year FROM accident.date) AS INTEGER) AS year
+    FROM accident
+    WHERE accident.violation_id IS NOT NULL
+)
+SELECT
+    accident.id AS acc_id,
+    accident.year AS acc_year,
+{accident_columns},
+    violation.birthday AS vio_birthday,
+    violation.date AS vio_date,
+    violation.is_recidivist::Integer AS vio_is_recidivist,
+    violation.is_patched::Integer AS vio_is_patched,
+{rate_columns}
+FROM accident_year AS accident
+JOIN violation ON accident.violation_id = violation.id
+{rate_joins}
+"""
+
+ACCIDENT_COLUMNS_SQL = ',\n'.join(f'    accident.{column} AS acc_{column}' for column in ACCIDENT_EXPORT_COLUMNS)
+
+# one join per rate table, rate tables are appended to so the last loaded rate of a year is taken
+TABLES_EXPORT_SELECT_SQL = EXPORT_SELECT_SQL.format(
+    accident_columns=ACCIDENT_COLUMNS_SQL,
+    rate_columns=',\n'.join(f'    "{table}".rate AS {table}_rate' for table in RATE_TABLES),
+    rate_joins='\n'.join(
+        f'LEFT OUTER JOIN LATERAL (SELECT rate FROM "{table}" WHERE address_code = accident.party_address_code '
+        f'AND year = accident.year ORDER BY id DESC LIMIT 1) AS "{table}" ON TRUE'
+        for table in RATE_TABLES
+    ),
+)
+
+# a single join on the wide region_indicator table, loaded by loader.load_region_indicator
+INDICATOR_EXPORT_SELECT_SQL = EXPORT_SELECT_SQL.format(
+    accident_columns=ACCIDENT_COLUMNS_SQL,
+    rate_columns=',\n'.join(f'    region_indicator.{table} AS {table}_rate' for table in RATE_TABLES),
+    rate_joins=(
+        'LEFT OUTER JOIN region_indicator ON region_indicator.address_code = accident.party_address_code '
+        'AND region_indicator.year = accident.year'
+    ),
+)
+
+CREATE_VIEW_SQL = 'CREATE MATERIALIZED VIEW IF NOT EXISTS {view} AS {select} WITH NO DATA'
+
+CREATE_VIEW_INDEX_SQL = [
+    # REFRESH ... CONCURRENTLY requires a unique index
+    f'CREATE UNIQUE INDEX IF NOT EXISTS {EXPORT_VIEW}_acc_id_idx ON {EXPORT_VIEW} (acc_id)',
+    f'CREATE INDEX IF NOT EXISTS {EXPORT_VIEW}_acc_year_idx ON {EXPORT_VIEW} (acc_year)',
+]
+
+DROP_VIEW_SQL = f'DROP MATERIALIZED VIEW IF EXISTS {EXPORT_VIEW}'
+
+IS_POPULATED_SQL = 'SELECT ispopulated FROM pg_matviews WHERE matviewname = :name'
+
+
+def create_export(db='default', rebuild=False, indicator=False):
+    """Create the export view, rebuild drops the view first.
+
+    With indicator the rates are joined from the region_indicator table instead of the six rate
+    tables, an existing view keeps its definition until rebuilt.
+    """
+    select = INDICATOR_EXPORT_SELECT_SQL if indicator else TABLES_EXPORT_SELECT_SQL
+    with session_scope(db) as s:
+        if rebuild:
+            s.execute(DROP_VIEW_SQL)
+        s.execute(CREATE_VIEW_SQL.format(view=EXPORT_VIEW, select=select))
+        for sql in CREATE_VIEW_INDEX_SQL:
+            s.execute(sql)
+        for table in RATE_TABLES + ['region_indicator']:
+            s.execute(f'ANALYZE "{table}"')
+
+
+def refresh_export(db='default'):
+    """Recompute the export view.
+
+    A populated view is refreshed concurrently: PostgreSQL diffs the new result against the
+    stored rows and writes only the changed ones, and readers are not blocked meanwhile.
+    """
+    with session_scope(db) as s:
+        populated = s.execute(IS_POPULATED_SQL, {'name': EXPORT_VIEW}).scalar()
+        concurrently = 'CONCURRENTLY ' if populated else ''
+        s.execute(f'REFRESH MATERIALIZED VIEW {concurrently}{EXPORT_VIEW}')
+        count = s.execute(f'SELECT count(*) FROM {EXPORT_VIEW}').scalar()
+    print(f'Refresh {EXPORT_VIEW}{" concurrently" if populated else ""}, row count: {count}.')
+    return count
+
+
+def is_export_populated(db='default'):
+    with session_scope(db) as s:
+        return bool(s.execute(IS_POPULATED_SQL, {'name': EXPORT_VIEW}).scalar())
+
+
+def copy_export(output_dir, db='default', split_by_year=False, buffer_size=2 ** 20):
+    """Write the export view to CSV files with COPY TO, return {file path: row count}.
+
+    The rows are streamed from the server in buffer_size reads, split_by_year writes one
+    file per accident year, served by the year index of the view.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    connection = get_engine(db).raw_connection()
+    counts = dict()
+    try:
+        cursor = connection.cursor()
+        if split_by_year:
+            cursor.execute(f'SELECT DISTINCT acc_year FROM {EXPORT_VIEW} ORDER BY acc_year')
+            parts = [(f'{EXPORT_VIEW}_{year}.csv', cursor.mogrify('WHERE acc_year = %s', (year, )).decode())
+                     for year, in cursor.fetchall()]
+        else:
+            parts = [(f'{EXPORT_VIEW}.csv', '')]
+        for file_name, where in parts:
+            path = os.path.join(output_dir, file_name)
+            sql = (f'COPY (SELECT * FROM {EXPORT_VIEW} {where} ORDER BY acc_date DESC, acc_id) '
+                   f'TO STDOUT WITH (FORMAT csv, HEADER)')
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                cursor.copy_expert(sql, f, size=buffer_size)
+            counts[path] = cursor.rowcount
+            # raw connection statements are not seen by the engine events
+            profiler.add(statements=1, rows=cursor.rowcount)
+        cursor.close()
+        connection.commit()
+    finally:
+        connection.close()
+    return counts
@@ -0,0 +1,85 @@
+from hashlib import blake2b
+from collections import OrderedDict
+from multiprocessing import Pool
+
+
+def hash_uid(uid):
+    """Pseudonymise an uid, the same uid always gives the same 'I-' prefixed digest."""
+    return 'I-' + blake2b(uid.encode('utf-8'), digest_size=5).hexdigest()
+
+
+class UidHasher:
+    """Memoized uid hashing with a size capped LRU cache.
+
+    The same person appears in many violation rows, repeated uids cost a dictionary lookup.
+    """
+
+    def __init__(self, max_size=2 ** 20, parallel_threshold=10 ** 6):
+        self.max_size = max_size
+        self.parallel_threshold = parallel_threshold
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def _store(self, uid, digest):
+        self._cache[uid] = digest
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def hash(self, uid):
+        digest = self._cache.get(uid)
+        if digest is not None:
+            self.hits += 1
+            self._cache.move_to_end(uid)
+            return digest
+        self.misses += 1
+        digest = hash_uid(uid)
+        self._store(uid, digest)
+        return digest
+
+    def hash_many(self, uids, processes=None):
+        """Hash a list or array of uids, each distinct uncached uid is hashed once.
+
+        Batches with more distinct uncached uids than parallel_threshold are hashed by a
+        process pool when processes is given.
+        """
+        uids = list(uids)
+        mapping = dict()
+        missing = list()
+        for uid in uids:
+            if uid in mapping:
+                continue
+            digest = self._cache.get(uid)
+            mapping[uid] = digest
+            if digest is None:
+                missing.append(uid)
+        self.misses += len(missing)
+        self.hits += len(uids) - len(missing)
+
+        if processes and len(missing) >= self.parallel_threshold:
+            with Pool(processes=processes) as pool:
+                digests = pool.map(hash_uid, missing, chunksize=10000)
+        else:
+            digests = map(hash_uid, missing)
+        for uid, digest in zip(missing, digests):
+            mapping[uid] = digest
+            self._store(uid, digest)
+        return [mapping[uid] for uid in uids]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._cache),
+            'max_size': self.max_size,
+        }
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._cache.clear()
+
+
+uid_hasher = UidHasher()
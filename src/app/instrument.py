@@ -0,0 +1,118 @@
+"""Lightweight per stage instrumentation.
+
+Stages are timed with `profiler.stage(name)`, statements executed through SQLAlchemy engines are
+counted against the innermost stage of the executing thread. Nothing is recorded until the
+profiler is enabled, e.g. by `manage.py --profile`.
+"""
+import json
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+def _new_stage():
+    return {'seconds': 0.0, 'calls': 0, 'rows': 0, 'statements': 0, 'executemany_rows': 0, 'rows_touched': 0}
+
+
+class Profiler:
+
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        self.stages = defaultdict(_new_stage)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._engines = set()
+
+    def enable(self, engines=()):
+        """Start recording and count statements of the given engines, or of every Engine given the class."""
+        from sqlalchemy import event
+        self.enabled = True
+        self.started = self.started or time.time()
+        for engine in engines:
+            if id(engine) in self._engines:
+                continue
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+            self._engines.add(id(engine))
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current_stage(self):
+        stack = self._stack()
+        return stack[-1] if stack else 'other'
+
+    def add(self, name=None, **values):
+        if not self.enabled:
+            return
+        with self._lock:
+            stage = self.stages[name or self.current_stage()]
+            for key, value in values.items():
+                stage[key] += value
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block, set counters['rows'] inside it to record processed rows."""
+        counters = {'rows': 0}
+        if not self.enabled:
+            yield counters
+            return
+        stack = self._stack()
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            stack.pop()
+            self.add(name, seconds=time.perf_counter() - start, calls=1, rows=counters['rows'])
+
+    def timed_iter(self, name, iterable, rows=len):
+        """Yield from iterable, recording the time spent producing each item under name."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as counters:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                counters['rows'] = rows(item) if rows else 0
+            yield item
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.add(statements=1, executemany_rows=len(parameters) if executemany else 0)
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if cursor.rowcount and cursor.rowcount > 0 and not statement.lstrip().upper().startswith('SELECT'):
+            self.add(rows_touched=cursor.rowcount)
+
+    def report(self):
+        with self._lock:
+            stages = {name: dict(values) for name, values in self.stages.items()}
+        for values in stages.values():
+            values['rows_per_sec'] = values['rows'] / values['seconds'] if values['seconds'] else None
+        return {
+            'started': self.started,
+            'elapsed': time.time() - self.started if self.started else None,
+            'stages': stages,
+        }
+
+    def merge(self, report):
+        """Add the stages of a report collected in another process."""
+        for name, values in report['stages'].items():
+            self.add(name, **{key: value for key, value in values.items() if key != 'rows_per_sec'})
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
+
+profiler = Profiler()
@@ -1,122 +1,82 @@
-import re
 import os
-from hashlib import blake2b
+import csv
+import glob
+import queue
+import threading
+from functools import partial
+from operator import itemgetter, attrgetter
+from collections import Counter
+from contextlib import nullcontext
+from multiprocessing import Pool
 from more_itertools import chunked
-from openpyxl import load_workbook
-from datetime import datetime
-from .database.utils import session_scope
-from .database.models import Violation, Accident, CountryTown
+from openpyxl import Workbook, load_workbook
+from .hashing import uid_hasher
+from .instrument import profiler
+from .parsers import (
+    DataMissingError,
+    DataValidationError,
+    validate_uid,
+    ACCIDENT_LAYOUT,
+    VIOLATION_LAYOUT,
+    parse_accident_row,
+    parse_violation_row
+)
+from .rejects import RejectSink
+from .manifest import LINKS, load_with_manifest, check_uids_not_encrypted
+from .partition import is_partitioned, ensure_partitions, partition_name, split_by_year, filter_year
+from .staging import staged_path, find_stage, write_stage, read_stage, read_stage_rejects
+from .database.utils import session_scope, copy_rows, dispose_engines, copy_temp_table
+from .database.models import (
+    Violation, Accident, CountryTown, Divorce, Old, Indigenous, Education, IncomeMid, IncomeAvg
+)
 
 
-uid_pattern = re.compile('^[A-Z][0-9]{9}$')
+VIOLATION_COLUMNS = ('uid', 'birthday', 'date')
 
 
-class DataMissingError(Exception):
-    """Uid missing from source."""
-    def __init__(self, fields):
-        super().__init__(f"DataMissingError: fields={','.join(fields)}")
+def violation_row_to_instance(row, report=print):
+    return Violation(**parse_violation_row(row, report))
 
 
-class DataValidationError(Exception):
-    """Invalid data."""
-    def __init__(self, field, msg):
-        super().__init__(f"DataValidationError: field={field} | msg={msg}")
+def violation_row_to_tuple(row, report=print):
+    fields = parse_violation_row(row, report)
+    return tuple(fields[column] for column in VIOLATION_COLUMNS)
 
 
-def validate_uid(uid):
-    return bool(re.match(uid_pattern, str(uid)))
+ACCIDENT_COLUMNS = (
+    'date', 'hour', 'dead', 'injured', 'party_no', 'gender_no', 'uid', 'driver_birthday', 'birthday',
+    'country', 'town', 'party_address_code', 'party_country', 'party_town', 'injury_level',
+    'driver_level', 'drunk_level', 'hit_and_run', 'job', 'cause_type', 'car_type',
+)
 
 
-def violation_row_to_instance(row):
-    uid, birthday, date = map(lambda idx: row[idx].value, [3, 4, 16])
-    invalid_fields = []
-    if birthday == 'NULL':
-        birthday = None
-    if not uid:
-        invalid_fields.append('uid')
-    if not date:
-        invalid_fields.append('date')
-    if invalid_fields:
-        raise DataMissingError(invalid_fields)
-    if not validate_uid(uid):
-        raise DataValidationError('uid', f'invalid value {uid}')
-    return Violation(
-        uid=uid,
-        birthday=datetime.strptime(birthday, '%m/%d/%Y').date() if birthday else None,
-        date=date.date() if isinstance(date, datetime) else datetime.strptime(date, '%Y-%m-%d'),
-    )
+def accident_row_to_instance(row, report=print):
+    return Accident(**parse_accident_row(row, report))
 
 
-def accident_row_to_instance(row):
-    meta = [
-        ('date', 0, datetime, True), ('hour', 1, int, True), ('country', 2, str, True),
-        ('town', 3, str, True),  ('dead', 6, int, True), ('injured', 7, int, True),
-        ('driver_birthday', 10, str, False),
-        ('party_no', 11, int, True), ('gender_no', 12, int, True), ('uid', 13, str, True),
-        ('birthday', 15, str, True), ('party_address_code', 17, int, False),
-        ('party_country', 18, str, False), ('party_town', 19, str, False),
-        ('injury_level', 21, int, True), ('driver_level', 22, int, True),
-        ('drunk_level', 23, int, True), ('hit_and_run', 24, int, True), ('job', 25, int, True),
-        ('car_type', 26, str, True), ('cause_type', 27, int, False),
-    ]
-    fields = dict()
-    for field, idx, _type, required in meta:
-        value = row[idx].value
-        if type(value) == str:
-            value = value.strip()
-        if value in ('', 'NULL'):
-            value = None
-        if required and value is None:
-            raise DataMissingError([field])
-        if value is not None and not type(value) == _type:
-            raise DataValidationError(field, f"'{value}' is not {_type}")
-        fields[field] = value
-
-    if not validate_uid(fields['uid']):
-        raise DataValidationError('uid', f"invalid value {fields['uid']}")
-
-    format_driver_birthday = None
-    if fields['driver_birthday']:
-        try:
-            format_driver_birthday = datetime.strptime(fields['driver_birthday'], '%m/%d/%Y').date()
-        except ValueError:
-            exc = DataValidationError('driver_birthday', f"invalid value {fields['driver_birthday']}")
-            print(exc)
+def accident_row_to_tuple(row, report=print):
+    fields = parse_accident_row(row, report)
+    return tuple(fields[column] for column in ACCIDENT_COLUMNS)
 
-    format_birthday = None
-    try:
-        format_birthday = datetime.strptime(fields['birthday'], '%Y/%m/%d').date()
-    except ValueError:
-        exc = DataValidationError('birthday', f"invalid value {fields['birthday']}")
-        print(exc)
-
-    return Accident(
-        date=fields['date'].date(),
-        hour=fields['hour'],
-        dead=fields['dead'],
-        injured=fields['injured'],
-        party_no=fields['party_no'],
-        gender_no=fields['gender_no'],
-        uid=fields['uid'],
-        driver_birthday=format_driver_birthday,
-        birthday=format_birthday,
-        country=fields['country'],
-        town=fields['town'],
-        party_address_code=fields['party_address_code'],
-        party_country=fields['party_country'],
-        party_town=fields['party_town'],
-        injury_level=fields['injury_level'],
-        driver_level=fields['driver_level'],
-        drunk_level=fields['drunk_level'],
-        hit_and_run=fields['hit_and_run'],
-        job=fields['job'],
-        cause_type=fields['cause_type'],
-        car_type=fields['car_type'],
-    )
 
+REGION_COLUMNS = ('address_code', 'year', 'rate')
+
+REGION_MODELS = {
+    'divorce': Divorce,
+    'old': Old,
+    'indigenous': Indigenous,
+    'education': Education,
+    'income_mid': IncomeMid,
+    'income_avg': IncomeAvg
+}
 
-def region_data_to_instances(row, mapping, model_class):
-    instances = []
+REGION_YEAR_MAPPING = {
+    idx: year for idx, year in zip(range(4, 14), range(2010, 2021))
+}
+
+
+def parse_region_row(row, mapping):
+    items = []
     address_code = row[2].value
     for idx, year in mapping.items():
         rate = row[idx].value
@@ -128,17 +88,26 @@ def region_data_to_instances(row, mapping, model_class):
             float(rate)
         except ValueError:
             raise DataValidationError(field='rate', msg=f'Invalid value {rate}')
-        instances.append(
-            model_class(
-                address_code=address_code,
-                year=year,
-                rate=rate
-            )
-        )
-    return instances
+        items.append(dict(
+            address_code=address_code,
+            year=year,
+            rate=rate
+        ))
+    return items
+
+
+def region_data_to_instances(row, mapping, model_class, report=print):
+    return [model_class(**fields) for fields in parse_region_row(row, mapping)]
 
 
-def country_town_data_to_instances(row):
+def region_data_to_tuples(row, mapping, report=print):
+    return [tuple(fields[column] for column in REGION_COLUMNS) for fields in parse_region_row(row, mapping)]
+
+
+COUNTRY_TOWN_COLUMNS = ('country', 'town', 'code')
+
+
+def parse_country_town_row(row):
     country, code, town = map(lambda idx: row[idx].value, [1, 2, 3])
     if not country:
         raise DataMissingError(fields=['country'])
@@ -146,32 +115,415 @@ def country_town_data_to_instances(row):
         raise DataMissingError(fields=['code'])
     if not town:
         raise DataMissingError(fields=['town'])
-    return CountryTown(
+    return dict(
         country=country,
         town=town,
         code=code
     )
 
 
-def load_data(file_path, hook, skip_first=True, chunk=2000, sheet=0):
+def country_town_data_to_instances(row, report=print):
+    return CountryTown(**parse_country_town_row(row))
+
+
+def country_town_data_to_tuple(row, report=print):
+    fields = parse_country_town_row(row)
+    return tuple(fields[column] for column in COUNTRY_TOWN_COLUMNS)
+
+
+def parse_chunks(file_path, hook, skip_first=True, chunk=2000, sheet=0, sink=None):
+    """Yield (parsed rows, rejected row count) per chunk.
+
+    Hooks are called with the row and a report function of the errors of lenient fields. Rows
+    rejected by the hook and those errors are recorded to the reject sink, or printed without one.
+    """
     wb = load_workbook(file_path, read_only=True)
     gen = wb.worksheets[sheet].rows
     if skip_first:
         next(gen)
+    current = {'row_no': None, 'row': None}
+
+    def report(exc, kind='warning'):
+        if sink is None:
+            print(f"{exc} | file={file_path} | row no={current['row_no']}")
+        else:
+            sink.add(file_path, current['row_no'], exc, [cell.value for cell in current['row']], kind=kind)
+
     for i, rows in enumerate(chunked(gen, chunk)):
         data = list()
+        rejected = 0
         for j, row in enumerate(rows):
+            current['row_no'] = i * chunk + j + 1 + int(skip_first)
+            current['row'] = row
             try:
-                parsed = hook(row)
+                parsed = hook(row, report=report)
                 if isinstance(parsed, list):
                     data += parsed
                 else:
                     data.append(parsed)
             except (DataMissingError, DataValidationError) as e:
-                row_no = i * chunk + j + 1 + int(skip_first)
-                print(f'{e} | file={file_path} | row no={row_no}')
+                rejected += 1
+                report(e, kind='rejected')
+        yield data, rejected
+    wb.close()
+
+
+def find_table_stage(file_path, table, sheet=0):
+    """Return the staging cache file of a workbook for the current layout of the table, or None."""
+    return find_stage(file_path, table, sheet, get_stage_layout(table)) if table else None
+
+
+def read_chunks(file_path, hook, skip_first=True, chunk=2000, sheet=0, table=None, instances=False, sink=None,
+                stage=None):
+    """Yield (rows, rejected) chunks from the stage file of the table when given, else parse the file.
+
+    Staged tuples are turned into model instances when instances is true.
+    """
+    if stage:
+        print(f'Read staged file {stage} | file={file_path}')
+        model_class, _, _, columns = get_table_layout(table)
+        for rows, rejected in read_stage(stage, model_class, chunk):
+            if instances:
+                rows = [model_class(**dict(zip(columns, row))) for row in rows]
+            yield rows, rejected
+        return
+    yield from parse_chunks(file_path, hook, skip_first, chunk, sheet, sink)
+
+
+def open_reject_sink(file_path, table, sheet, rejects, stage=None):
+    """Open the rejected rows file, a staged read keeps the one written by the stage instead."""
+    if not rejects or stage:
+        return nullcontext()
+    return RejectSink.for_file(file_path, table, sheet, output_format=rejects)
+
+
+def _add_reject_summary(summary, sink, stage=None):
+    if sink is not None:
+        summary['rejects_file'] = sink.path
+        summary['reasons'] = sink.summary()
+    elif stage:
+        rejects = read_stage_rejects(stage)
+        if rejects['rejects_file']:
+            summary['rejects_file'] = rejects['rejects_file']
+            summary['reasons'] = rejects['reasons']
+    return summary
+
+
+def write_chunks(chunks, write, queue_depth=0, writers=1):
+    """Write parsed chunks and return the loaded, rejected row counts.
+
+    With queue_depth > 0 chunks are handed to writer threads through a bounded queue, so parsing
+    the next chunks overlaps with writing the previous ones and the parser blocks when the queue
+    is full. Every writer thread uses its own session or connection.
+    """
+    loaded = rejected = 0
+    chunks = profiler.timed_iter('load.parse', chunks, rows=lambda item: len(item[0]))
+    if not queue_depth:
+        for data, chunk_rejected in chunks:
+            with profiler.stage('load.write') as counters:
+                write(data)
+                counters['rows'] = len(data)
+            loaded += len(data)
+            rejected += chunk_rejected
+        return loaded, rejected
+
+    q = queue.Queue(maxsize=queue_depth)
+    errors = []
+
+    def worker():
+        while True:
+            data = q.get()
+            if data is None:
+                return
+            # keep draining after a failure so the parser never blocks
+            if not errors:
+                try:
+                    with profiler.stage('load.write') as counters:
+                        write(data)
+                        counters['rows'] = len(data)
+                except Exception as e:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for data, chunk_rejected in chunks:
+            if errors:
+                break
+            q.put(data)
+            loaded += len(data)
+            rejected += chunk_rejected
+    finally:
+        for _ in threads:
+            q.put(None)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return loaded, rejected
+
+
+def load_data(file_path, hook, skip_first=True, chunk=2000, sheet=0, source_file_id=None,
+              queue_depth=0, writers=1, table=None, rejects=None, year=None):
+    """Load rows through ORM bulk inserts, with year only the rows dated in that year are kept."""
+    def write(data):
+        if not data:
+            return
+        if source_file_id is not None:
+            for instance in data:
+                instance.source_file_id = source_file_id
+        table_name = type(data[0]).__tablename__
+        if is_partitioned(table_name):
+            # PostgreSQL routes the inserted rows, their partitions must exist
+            ensure_partitions(table_name, {instance.date.year for instance in data})
+        # bulk_save_objects omits None attributes and splits the chunk into one INSERT per run of
+        # rows with the same missing fields, explicit NULLs keep the chunk in one executemany batch
+        mappings = [
+            {key: value for key, value in vars(instance).items() if key != '_sa_instance_state'}
+            for instance in data
+        ]
         with session_scope() as s:
-            s.bulk_save_objects(data)
+            s.bulk_insert_mappings(type(data[0]), mappings, render_nulls=True)
+
+    stage = find_table_stage(file_path, table, sheet)
+    with open_reject_sink(file_path, table, sheet, rejects, stage) as sink:
+        chunks = read_chunks(
+            file_path, hook, skip_first, chunk, sheet, table=table, instances=True, sink=sink, stage=stage
+        )
+        if year is not None:
+            chunks = filter_year(chunks, attrgetter('date'), year)
+        loaded, rejected = write_chunks(chunks, write, queue_depth, writers)
+    return _add_reject_summary({'file': file_path, 'loaded': loaded, 'rejected': rejected}, sink, stage)
+
+
+def copy_data(file_path, hook, model_class, columns, skip_first=True, chunk=20000, sheet=0, source_file_id=None,
+              queue_depth=0, writers=1, table=None, rejects=None, year=None):
+    """Load rows through COPY FROM STDIN, the hook must return tuples ordered as columns.
+
+    Rows of a partitioned table are copied straight into the partition of their year, with year
+    only the rows dated in that year are kept.
+    """
+    extra = {'source_file_id': source_file_id} if source_file_id is not None else None
+    table_name = model_class.__tablename__
+    date_of = itemgetter(columns.index('date')) if 'date' in columns else None
+
+    def write(data):
+        if not is_partitioned(table_name):
+            copy_rows(model_class, columns, data, extra=extra)
+            return
+        for row_year, rows in split_by_year(data, date_of).items():
+            ensure_partitions(table_name, [row_year])
+            copy_rows(model_class, columns, rows, extra=extra, partition=partition_name(table_name, row_year))
+
+    stage = find_table_stage(file_path, table, sheet)
+    with open_reject_sink(file_path, table, sheet, rejects, stage) as sink:
+        chunks = read_chunks(file_path, hook, skip_first, chunk, sheet, table=table, sink=sink, stage=stage)
+        if year is not None:
+            chunks = filter_year(chunks, date_of, year)
+        loaded, rejected = write_chunks(chunks, write, queue_depth, writers)
+    return _add_reject_summary({'file': file_path, 'loaded': loaded, 'rejected': rejected}, sink, stage)
+
+
+def get_table_layout(table):
+    """Return the model class, instance hook, tuple hook and tuple columns of a loadable table."""
+    if table == 'violation':
+        return Violation, violation_row_to_instance, violation_row_to_tuple, VIOLATION_COLUMNS
+    if table == 'accident':
+        return Accident, accident_row_to_instance, accident_row_to_tuple, ACCIDENT_COLUMNS
+    if table == 'country_town':
+        return CountryTown, country_town_data_to_instances, country_town_data_to_tuple, COUNTRY_TOWN_COLUMNS
+    if table in REGION_MODELS:
+        model_class = REGION_MODELS[table]
+        return (
+            model_class,
+            partial(region_data_to_instances, mapping=REGION_YEAR_MAPPING, model_class=model_class),
+            partial(region_data_to_tuples, mapping=REGION_YEAR_MAPPING),
+            REGION_COLUMNS
+        )
+    raise ValueError(f'Unknown table {table}.')
+
+
+def get_stage_layout(table):
+    """Return what the staged rows of a table depend on besides the source file, keying its stages."""
+    columns = get_table_layout(table)[3]
+    if table == 'violation':
+        return columns, VIOLATION_LAYOUT
+    if table == 'accident':
+        return columns, ACCIDENT_LAYOUT
+    if table in REGION_MODELS:
+        return columns, REGION_YEAR_MAPPING
+    return columns
+
+
+def get_loader(table, mode='orm', incremental=False, queue_depth=0, writers=1, rejects=None, year=None):
+    """Return a load function of the table, call it with file path (and sheet).
+
+    Incremental loaders skip files recorded unchanged in the load manifest, they are refused for
+    accident and violation once encrypt_uid ran. queue_depth and writers configure the parse/write
+    pipeline of write_chunks and rejects is the output format ('jsonl' or 'csv') of the rejected
+    rows file, rejected rows are printed without it. With year only the rows dated in that year
+    are loaded.
+    """
+    model_class, instance_hook, tuple_hook, columns = get_table_layout(table)
+    if year is not None and 'date' not in columns:
+        raise ValueError(f'Table {table} has no date to select a year from.')
+    if incremental and table in LINKS:
+        with session_scope() as s:
+            check_uids_not_encrypted(s)
+    if mode == 'copy':
+        loader = partial(copy_data, hook=tuple_hook, model_class=model_class, columns=columns,
+                         queue_depth=queue_depth, writers=writers, table=table, rejects=rejects, year=year)
+    else:
+        loader = partial(load_data, hook=instance_hook, queue_depth=queue_depth, writers=writers, table=table,
+                         rejects=rejects, year=year)
+    if incremental:
+        return partial(load_with_manifest, loader=loader, model_class=model_class)
+    return loader
+
+
+def stage_data(file_path, table, skip_first=True, sheet=0, rejects=None):
+    """Parse a workbook once with the tuple hook of the table and write its staging cache file."""
+    model_class, _, tuple_hook, columns = get_table_layout(table)
+    rows = []
+    rejected = 0
+    with open_reject_sink(file_path, table, sheet, rejects) as sink:
+        for data, chunk_rejected in parse_chunks(file_path, tuple_hook, skip_first, sheet=sheet, sink=sink):
+            rows += data
+            rejected += chunk_rejected
+    path = staged_path(file_path, table, sheet, get_stage_layout(table))
+    if sink is None:
+        write_stage(path, model_class, columns, rows, rejected)
+    else:
+        write_stage(path, model_class, columns, rows, rejected, rejects_file=sink.path, reasons=sink.summary())
+    return _add_reject_summary({'file': file_path, 'staged': path, 'rows': len(rows), 'rejected': rejected}, sink)
+
+
+# indicator, workbook name and sheet of the region rate sources
+REGION_SOURCES = [
+    ('divorce', '01_divorce_r.xlsx', 0),
+    ('old', '02_old_r.xlsx', 0),
+    ('indigenous', '03_Indgnus_r.xlsx', 0),
+    ('education', '04_highedu_r.xlsx', 0),
+    ('income_mid', '05_income_r.xlsx', 0),
+    ('income_avg', '05_income_r.xlsx', 1),
+]
+
+UPSERT_REGION_INDICATOR_SQL = """
+INSERT INTO region_indicator (id, address_code, year, {columns})
+SELECT nextval('region_indicator_id_seq'), address_code, year, {columns}
+FROM region_pivot
+ON CONFLICT (address_code, year) DO UPDATE SET {updates}
+"""
+
+
+def load_region_indicator(directory, skip_first=True, rejects=None):
+    """Load the region rate workbooks of a directory into the wide region_indicator table.
+
+    Every sheet is parsed once and pivoted to one row per (address_code, year), which is upserted
+    with a single statement. Indicators missing from the directory keep their stored rates.
+    """
+    hook = partial(region_data_to_tuples, mapping=REGION_YEAR_MAPPING)
+    pivot = dict()
+    summaries = []
+    indicators = []
+    for indicator, file_name, sheet in REGION_SOURCES:
+        file_path = os.path.join(directory, file_name)
+        if not os.path.exists(file_path):
+            continue
+        indicators.append(indicator)
+        loaded = rejected = 0
+        with open_reject_sink(file_path, indicator, sheet, rejects) as sink:
+            for data, chunk_rejected in parse_chunks(file_path, hook, skip_first, sheet=sheet, sink=sink):
+                for address_code, year, rate in data:
+                    pivot.setdefault((address_code, year), {})[indicator] = rate
+                loaded += len(data)
+                rejected += chunk_rejected
+        summaries.append(_add_reject_summary({'file': file_path, 'loaded': loaded, 'rejected': rejected}, sink))
+    if not indicators:
+        return summaries
+
+    columns = ', '.join(indicators)
+    with session_scope() as s:
+        copy_temp_table(
+            s, 'region_pivot', f"address_code VARCHAR(8), year INTEGER, {', '.join(f'{i} FLOAT' for i in indicators)}",
+            [(address_code, year, *(rates.get(i) for i in indicators)) for (address_code, year), rates in pivot.items()]
+        )
+        result = s.execute(UPSERT_REGION_INDICATOR_SQL.format(
+            columns=columns, updates=', '.join(f'{i} = EXCLUDED.{i}' for i in indicators)
+        ))
+        print(f'Upsert region indicator, row count: {result.rowcount}.')
+    return summaries
+
+
+def expand_file_paths(pattern, extension='.xlsx'):
+    """Resolve a file path, a glob pattern or a directory to sorted file paths."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, f'*{extension}')
+    return sorted(glob.glob(pattern))
+
+
+def _load_file(loader, file_path, sheet, collect_profile=False):
+    try:
+        with profiler.stage('load.file'):
+            summary = loader(file_path, sheet=sheet)
+    except Exception as e:
+        summary = {'file': file_path, 'loaded': 0, 'rejected': 0, 'error': f'{type(e).__name__}: {e}'}
+    if collect_profile and profiler.enabled:
+        # hand the stages recorded in the worker process back to the parent
+        summary['profile'] = profiler.report()
+        profiler.reset()
+    return summary
+
+
+def load_files(file_paths, loader, sheet=0, processes=None):
+    """Load files with a process pool, each worker parses and writes its own chunks.
+
+    Return the per file summaries in the order of the given paths.
+    """
+    if processes == 1 or len(file_paths) <= 1:
+        return [_load_file(loader, file_path, sheet) for file_path in file_paths]
+    # do not share pooled connections with forked workers
+    dispose_engines()
+    with Pool(processes=processes, initializer=profiler.reset) as pool:
+        summaries = pool.starmap(
+            _load_file, [(loader, file_path, sheet, True) for file_path in file_paths], chunksize=1
+        )
+    for summary in summaries:
+        if 'profile' in summary:
+            profiler.merge(summary.pop('profile'))
+    return summaries
+
+
+def print_load_summary(summaries):
+    for summary in summaries:
+        line = f"file={summary['file']} | loaded={summary['loaded']} | rejected={summary['rejected']}"
+        if summary.get('skipped'):
+            line += ' | skipped=unchanged'
+        if summary.get('rejects_file'):
+            line += f" | rejects file={summary['rejects_file']}"
+        if summary.get('error'):
+            line += f" | error={summary['error']}"
+        print(line)
+    reasons = Counter()
+    for summary in summaries:
+        reasons.update(summary.get('reasons', {}))
+    for reason, count in reasons.most_common():
+        print(f'{reason}: {count}')
+    print(
+        f"Total files={len(summaries)} | loaded={sum(summary['loaded'] for summary in summaries)} | "
+        f"rejected={sum(summary['rejected'] for summary in summaries)} | "
+        f"skipped={sum(1 for summary in summaries if summary.get('skipped'))} | "
+        f"failed={sum(1 for summary in summaries if summary.get('error'))}"
+    )
+
+
+def encrypt_uid_value(value):
+    if type(value) == str:
+        value = value.strip()
+    if validate_uid(value):
+        return uid_hasher.hash(value)
+    return 'INVALID'
 
 
 def encrypt_uid_and_save_file(file_path, column_index, output_dir, skip_first=True, sheet=0):
@@ -182,12 +534,37 @@ def encrypt_uid_and_save_file(file_path, column_index, output_dir, skip_first=Tr
     if skip_first:
         next(gen)
     for row in gen:
-        value = row[column_index].value
-        if type(value) == str:
-            value = value.strip()
-        if validate_uid(value):
-            new_uid = 'I-' + blake2b(value.encode('utf-8'), digest_size=5).hexdigest()
-        else:
-            new_uid = 'INVALID'
-        row[column_index].value = new_uid
+        row[column_index].value = encrypt_uid_value(row[column_index].value)
     wb.save(output_path)
+
+
+def stream_encrypt_uid_and_save_file(file_path, column_index, output_dir, skip_first=True, sheet=0,
+                                     output_format='xlsx'):
+    """Same as encrypt_uid_and_save_file with constant memory, cell styles are not kept.
+
+    Rows are read from a read only workbook and appended to a write only workbook, or to a
+    csv file of the encrypted sheet with output_format='csv'.
+    """
+    src = load_workbook(file_path, read_only=True)
+    base_name, _ = os.path.splitext(os.path.basename(file_path))
+    output_path = os.path.join(output_dir, f'{base_name}.{output_format}')
+
+    def encrypted_rows(ws):
+        for i, row in enumerate(ws.values):
+            values = list(row)
+            if (i > 0 or not skip_first) and len(values) > column_index:
+                values[column_index] = encrypt_uid_value(values[column_index])
+            yield values
+
+    if output_format == 'csv':
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(encrypted_rows(src.worksheets[sheet]))
+    else:
+        dst = Workbook(write_only=True)
+        for idx, ws in enumerate(src.worksheets):
+            dst_ws = dst.create_sheet(title=ws.title)
+            rows = encrypted_rows(ws) if idx == sheet else ws.values
+            for values in rows:
+                dst_ws.append(values)
+        dst.save(output_path)
+    src.close()
@@ -0,0 +1,112 @@
+import os
+from hashlib import blake2b
+from datetime import datetime
+from sqlalchemy import text
+from .database.utils import session_scope
+from .database.models import LoadManifest
+
+
+# links of other tables to the rows of a table, as (table, link column)
+LINKS = {
+    'accident': ('violation', 'accident_id'),
+    'violation': ('accident', 'violation_id'),
+}
+
+# violations created by the transform for accidents without one
+DELETE_PATCHED_VIOLATION_SQL = """
+DELETE FROM violation WHERE is_patched AND accident_id IN ({ids})
+"""
+
+# uids are rewritten to 'I-' hashes by the encrypt_uid transform step
+ENCRYPTED_UID_SQL = """
+SELECT EXISTS (SELECT 1 FROM accident WHERE uid LIKE 'I-%') OR EXISTS (SELECT 1 FROM violation WHERE uid LIKE 'I-%')
+"""
+
+UNLINK_SQL = """
+UPDATE {table} SET {column} = NULL WHERE {column} IN ({ids})
+"""
+
+
+def unlink_rows(connection, table_name, ids_sql, params=None):
+    """Clear the links of other tables to the rows selected by ids_sql, before the rows are deleted.
+
+    Violations patched in for the deleted accidents are deleted as well, the unlinked rows are
+    matched again by the next transform.
+    """
+    if table_name not in LINKS:
+        return
+    if table_name == 'accident':
+        connection.execute(text(DELETE_PATCHED_VIOLATION_SQL.format(ids=ids_sql)), params or {})
+    table, column = LINKS[table_name]
+    connection.execute(text(UNLINK_SQL.format(table=table, column=column, ids=ids_sql)), params or {})
+
+
+def unlink_source_rows(session, table_name, source_file_id):
+    unlink_rows(
+        session, table_name, f'SELECT id FROM {table_name} WHERE source_file_id = :source_file_id',
+        {'source_file_id': source_file_id}
+    )
+
+
+def check_uids_not_encrypted(session):
+    """Raise ValueError once encrypt_uid ran, reloaded raw uids would not match the encrypted rows."""
+    if session.execute(ENCRYPTED_UID_SQL).scalar():
+        raise ValueError(
+            'Accident and violation uids are already encrypted, incremental loads must run before the '
+            'encrypt_uid transform step. Recreate the tables and load every file again instead.'
+        )
+
+
+def file_hash(file_path, block_size=2 ** 20):
+    digest = blake2b(digest_size=32)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_with_manifest(file_path, loader, model_class, sheet=0):
+    """Load a file once, reloads of a changed file replace only the rows tagged with its manifest id.
+
+    Files whose size and mtime, or content hash, match a finished manifest entry are skipped.
+    An entry left in 'loading' status by an interrupted run is reloaded.
+    """
+    path = os.path.abspath(file_path)
+    table_name = model_class.__tablename__
+    stat = os.stat(path)
+    with session_scope() as s:
+        manifest = s.query(LoadManifest).filter_by(path=path, table_name=table_name, sheet=sheet).one_or_none()
+        if manifest and manifest.status == 'loaded':
+            unchanged = manifest.size == stat.st_size and manifest.mtime == stat.st_mtime
+            if not unchanged and manifest.content_hash == file_hash(path):
+                manifest.size, manifest.mtime = stat.st_size, stat.st_mtime
+                unchanged = True
+            if unchanged:
+                return {'file': file_path, 'loaded': 0, 'rejected': 0, 'skipped': True}
+        if manifest is None:
+            manifest = LoadManifest(path=path, table_name=table_name, sheet=sheet, status='loading')
+            s.add(manifest)
+            s.flush()
+        else:
+            unlink_source_rows(s, table_name, manifest.id)
+            deleted = s.query(model_class).filter(model_class.source_file_id == manifest.id).delete(
+                synchronize_session=False
+            )
+            print(f'Delete {deleted} rows previously loaded from {file_path}.')
+            manifest.status = 'loading'
+        manifest_id = manifest.id
+
+    content_hash = file_hash(path)
+    summary = loader(file_path, sheet=sheet, source_file_id=manifest_id)
+
+    with session_scope() as s:
+        s.query(LoadManifest).filter(LoadManifest.id == manifest_id).update({
+            LoadManifest.size: stat.st_size,
+            LoadManifest.mtime: stat.st_mtime,
+            LoadManifest.content_hash: content_hash,
+            LoadManifest.status: 'loaded',
+            LoadManifest.loaded: summary['loaded'],
+            LoadManifest.rejected: summary['rejected'],
+            LoadManifest.updated_at: datetime.now(),
+        })
+    return summary
@@ -0,0 +1,66 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from .database.utils import session_scope, copy_temp_table
+from .database.models import Violation, Accident
+
+
+def match_nearest(accidents, violations, tolerance=0):
+    """Pair (id, uid, date) accidents with violations of the same uid within ±tolerance days.
+
+    Violations are indexed by uid with sorted dates, so the candidates of an accident are
+    found with a binary search instead of a table scan per tolerance day. Candidate pairs are
+    resolved nearest date first and each accident, violation is used at most once.
+    Return a list of (accident id, violation id).
+    """
+    index = defaultdict(list)
+    for pk, uid, date in violations:
+        index[uid].append((date.toordinal(), pk))
+    for items in index.values():
+        items.sort()
+
+    candidates = []
+    for accident_pk, uid, date in accidents:
+        items = index.get(uid)
+        if not items:
+            continue
+        day = date.toordinal()
+        start = bisect_left(items, (day - tolerance, ))
+        end = bisect_right(items, (day + tolerance, float('inf')))
+        for violation_day, violation_pk in items[start:end]:
+            candidates.append((abs(violation_day - day), accident_pk, violation_pk))
+    candidates.sort()
+
+    matches = []
+    matched_accidents = set()
+    matched_violations = set()
+    for _, accident_pk, violation_pk in candidates:
+        if accident_pk in matched_accidents or violation_pk in matched_violations:
+            continue
+        matched_accidents.add(accident_pk)
+        matched_violations.add(violation_pk)
+        matches.append((accident_pk, violation_pk))
+    return matches
+
+
+def match_violations(tolerance=0):
+    """Link unmatched accidents and violations in a single pass and write links back in bulk."""
+    with session_scope() as s:
+        accidents = s.query(Accident.id, Accident.uid, Accident.date).filter(
+            Accident.violation_id.is_(None),
+        ).all()
+        violations = s.query(Violation.id, Violation.uid, Violation.date).filter(
+            Violation.accident_id.is_(None),
+        ).all()
+        matches = match_nearest(accidents, violations, tolerance)
+        print(f'Associate Accident, Violation by same uid in {tolerance} delta days, match count: {len(matches)}.')
+
+        copy_temp_table(s, 'violation_match', 'accident_id INTEGER PRIMARY KEY, violation_id INTEGER', matches)
+        s.execute(
+            'UPDATE accident SET violation_id = violation_match.violation_id '
+            'FROM violation_match WHERE accident.id = violation_match.accident_id'
+        )
+        s.execute(
+            'UPDATE violation SET accident_id = violation_match.accident_id '
+            'FROM violation_match WHERE violation.id = violation_match.violation_id'
+        )
+    return matches
@@ -0,0 +1,155 @@
+"""Schema driven row parsers.
+
+A source layout is declared once as a list of fields and compiled into a row function with
+the type checks and date handlers resolved up front, instead of interpreting the layout for
+every row.
+"""
+import re
+from collections import namedtuple
+from datetime import date, datetime
+from functools import lru_cache
+
+
+uid_pattern = re.compile('^[A-Z][0-9]{9}$')
+
+
+class DataMissingError(Exception):
+    """Uid missing from source."""
+    reason = 'missing'
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        super().__init__(f"DataMissingError: fields={','.join(fields)}")
+
+
+class DataValidationError(Exception):
+    """Invalid data."""
+    def __init__(self, field, msg, reason='invalid'):
+        self.fields = [field]
+        self.msg = msg
+        self.reason = reason
+        super().__init__(f"DataValidationError: field={field} | msg={msg}")
+
+
+def validate_uid(uid):
+    return bool(re.match(uid_pattern, str(uid)))
+
+
+# type: accepted cell value type (or tuple of types), compared exactly.
+# date_format: parse the value to a date, datetime values are truncated to date.
+# lenient: report an unparsable date and keep None instead of rejecting the row.
+Field = namedtuple('Field', ['name', 'index', 'type', 'required', 'date_format', 'lenient'],
+                   defaults=(None, False))
+
+# formats parsed by splitting the string, as (separator, year, month, day positions)
+FAST_DATE_FORMATS = {
+    '%Y/%m/%d': ('/', 0, 1, 2),
+    '%m/%d/%Y': ('/', 2, 0, 1),
+    '%Y-%m-%d': ('-', 0, 1, 2),
+}
+
+
+def date_parser(date_format, cache_size=2 ** 16):
+    """Return a memoized string to date function, raising ValueError on invalid strings.
+
+    The formats of FAST_DATE_FORMATS split the usual strings instead of calling strptime.
+    """
+    if date_format in FAST_DATE_FORMATS:
+        sep, year, month, day = FAST_DATE_FORMATS[date_format]
+
+        def parse(text):
+            parts = text.split(sep)
+            if (
+                len(parts) != 3 or not all(part.isascii() and part.isdigit() for part in parts)
+                or len(parts[year]) != 4 or not 1 <= len(parts[month]) <= 2 or not 1 <= len(parts[day]) <= 2
+            ):
+                # anything but ascii digits with a 4 digit year is left to strptime, to accept the same strings
+                return datetime.strptime(text, date_format).date()
+            return date(int(parts[year]), int(parts[month]), int(parts[day]))
+    else:
+        def parse(text):
+            return datetime.strptime(text, date_format).date()
+    return lru_cache(maxsize=cache_size)(parse)
+
+
+def _types(field):
+    return field.type if isinstance(field.type, tuple) else (field.type, )
+
+
+def compile_parser(layout, uid_field='uid'):
+    """Compile a layout into a function mapping an openpyxl row to a dict of column values.
+
+    Strings are stripped and '' or 'NULL' are treated as missing. Missing required fields raise
+    DataMissingError, unexpected types and invalid uids raise DataValidationError. Errors of lenient
+    fields are passed to report, printed by default, and the field is kept as None.
+    """
+    checks = [(field.name, field.index, field.required, _types(field)) for field in layout]
+    dates = [
+        (field.name, date_parser(field.date_format) if field.date_format else None, field.lenient)
+        for field in layout if field.date_format or datetime in _types(field)
+    ]
+
+    def parse(row, report=print):
+        fields = dict()
+        missing = None
+        for name, index, required, types in checks:
+            value = row[index].value
+            if value.__class__ is str:
+                value = value.strip()
+                if value == '' or value == 'NULL':
+                    value = None
+            if value is None:
+                if required:
+                    missing = (missing or []) + [name]
+            elif value.__class__ not in types:
+                raise DataValidationError(
+                    name, f"'{value}' is not {types[0] if len(types) == 1 else types}", reason='type'
+                )
+            fields[name] = value
+        if missing:
+            raise DataMissingError(missing)
+
+        if uid_field:
+            uid = fields[uid_field]
+            if uid.__class__ is not str or not uid_pattern.match(uid):
+                raise DataValidationError(uid_field, f'invalid value {uid}')
+
+        for name, parse_date, lenient in dates:
+            value = fields[name]
+            if value is None:
+                continue
+            if isinstance(value, datetime):
+                fields[name] = value.date()
+                continue
+            try:
+                fields[name] = parse_date(value)
+            except (ValueError, TypeError):
+                exc = DataValidationError(name, f'invalid value {value}')
+                if not lenient:
+                    raise exc
+                report(exc)
+                fields[name] = None
+        return fields
+    return parse
+
+
+ACCIDENT_LAYOUT = [
+    Field('date', 0, datetime, True), Field('hour', 1, int, True), Field('country', 2, str, True),
+    Field('town', 3, str, True), Field('dead', 6, int, True), Field('injured', 7, int, True),
+    Field('driver_birthday', 10, str, False, '%m/%d/%Y', lenient=True),
+    Field('party_no', 11, int, True), Field('gender_no', 12, int, True), Field('uid', 13, str, True),
+    Field('birthday', 15, str, True, '%Y/%m/%d', lenient=True), Field('party_address_code', 17, int, False),
+    Field('party_country', 18, str, False), Field('party_town', 19, str, False),
+    Field('injury_level', 21, int, True), Field('driver_level', 22, int, True),
+    Field('drunk_level', 23, int, True), Field('hit_and_run', 24, int, True), Field('job', 25, int, True),
+    Field('car_type', 26, str, True), Field('cause_type', 27, int, False),
+]
+
+VIOLATION_LAYOUT = [
+    Field('uid', 3, str, True),
+    Field('birthday', 4, str, False, '%m/%d/%Y', lenient=True),
+    Field('date', 16, (datetime, str), True, '%Y-%m-%d'),
+]
+
+parse_accident_row = compile_parser(ACCIDENT_LAYOUT)
+parse_violation_row = compile_parser(VIOLATION_LAYOUT)
@@ -0,0 +1,160 @@
+"""Yearly partitions of the tables created by `init --partition-by-year`.
+
+A partition '{table}_y{year}' holds the rows dated in that year. The loaders create the
+partitions of the years they meet and copy rows straight into them, and a single year can be
+detached, attached again or truncated before it is reloaded.
+"""
+from collections import defaultdict
+from sqlalchemy import text
+from .database import get_engine
+from .manifest import unlink_rows
+from .database.utils import PARTITIONED_TABLES
+
+IS_PARTITIONED_SQL = """
+SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)
+"""
+
+# attached and detached partitions, named after the parent table
+PARTITIONS_SQL = """
+SELECT relname, relispartition
+FROM pg_class
+WHERE relkind = 'r' AND relnamespace = current_schema()::regnamespace AND relname ~ :pattern
+ORDER BY relname
+"""
+
+CREATE_PARTITION_SQL = """
+CREATE TABLE {partition} PARTITION OF {table} FOR VALUES FROM ('{year:04d}-01-01') TO ('{next_year:04d}-01-01')
+"""
+
+ATTACH_PARTITION_SQL = """
+ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM ('{year:04d}-01-01') TO ('{next_year:04d}-01-01')
+"""
+
+# years of the accidents without violation, patch_missing_violation dates their violations alike
+MISSING_VIOLATION_YEARS_SQL = """
+SELECT DISTINCT extract(year FROM date)::int FROM accident WHERE violation_id IS NULL
+"""
+
+_partitioned = dict()
+_years = defaultdict(set)
+
+
+def partition_name(table, year):
+    return f'{table}_y{year:04d}'
+
+
+def is_partitioned(table, db='default'):
+    """Return whether a table was created partitioned, checked once per process."""
+    if table not in PARTITIONED_TABLES:
+        return False
+    if table not in _partitioned:
+        _partitioned[table] = bool(get_engine(db).execute(text(IS_PARTITIONED_SQL), table=table).scalar())
+    return _partitioned[table]
+
+
+def get_partitions(connection, table):
+    """Return {year: attached} of the partitions of a table."""
+    rows = connection.execute(text(PARTITIONS_SQL), pattern=f'^{table}_y[0-9]{{4}}$')
+    return {int(name[len(table) + 2:]): attached for name, attached in rows}
+
+
+def ensure_partitions(table, years, db='default'):
+    """Create the missing partitions of the years, once per process and year.
+
+    Concurrent loaders serialize on an advisory lock of the table. A detached partition of a
+    year is not replaced, rows of that year are refused until it is attached again or dropped.
+    """
+    missing = set(years) - _years[table]
+    if not missing:
+        return
+    with get_engine(db).begin() as connection:
+        connection.execute(text('SELECT pg_advisory_xact_lock(hashtext(:table))'), table=table)
+        partitions = get_partitions(connection, table)
+        for year in sorted(missing):
+            if year not in partitions:
+                connection.execute(CREATE_PARTITION_SQL.format(
+                    partition=partition_name(table, year), table=table, year=year, next_year=year + 1
+                ))
+                print(f'Create partition {partition_name(table, year)}.')
+            elif not partitions[year]:
+                raise ValueError(f'Partition {partition_name(table, year)} is detached, attach or drop it first.')
+    _years[table].update(missing)
+
+
+def ensure_missing_violation_partitions(db='default'):
+    """Create the violation partitions of the patched violations before they are inserted.
+
+    Call it outside the transaction inserting them, creating a partition locks the whole table.
+    """
+    if not is_partitioned('violation', db):
+        return
+    years = [year for year, in get_engine(db).execute(text(MISSING_VIOLATION_YEARS_SQL))]
+    ensure_partitions('violation', years, db)
+
+
+def split_by_year(rows, date_of):
+    """Return {year: rows} of a chunk, date_of returns the date of a row."""
+    years = defaultdict(list)
+    for row in rows:
+        years[date_of(row).year].append(row)
+    return years
+
+
+def filter_year(chunks, date_of, year):
+    """Yield (rows, rejected) chunks keeping the rows dated in year."""
+    for rows, rejected in chunks:
+        yield [row for row in rows if date_of(row).year == year], rejected
+
+
+def list_partitions(db='default'):
+    """Return (table, year, attached, row count) of every partition."""
+    engine = get_engine(db)
+    result = []
+    with engine.connect() as connection:
+        for table in PARTITIONED_TABLES:
+            for year, attached in sorted(get_partitions(connection, table).items()):
+                count = connection.execute(f'SELECT count(*) FROM {partition_name(table, year)}').scalar()
+                result.append((table, year, attached, count))
+    return result
+
+
+def _alter_partition(table, year, db, sql, message, attached=None, before=None):
+    """Run sql on the partition of a year, skipped when attached is given and differs from its state.
+
+    before is called with the connection and partition name first, in the same transaction.
+    """
+    if not is_partitioned(table, db):
+        raise ValueError(f'Table {table} is not partitioned, recreate it with init --partition-by-year.')
+    partition = partition_name(table, year)
+    with get_engine(db).begin() as connection:
+        partitions = get_partitions(connection, table)
+        if year not in partitions:
+            raise ValueError(f'Partition {partition} does not exist.')
+        if attached is not None and partitions[year] != attached:
+            print(f"Partition {partition} is already {'detached' if attached else 'attached'}.")
+            return
+        if before:
+            before(connection, partition)
+        connection.execute(sql.format(partition=partition, table=table, year=year, next_year=year + 1))
+    _years[table].discard(year)
+    print(f'{message} partition {partition}.')
+
+
+def detach_partition(table, year, db='default'):
+    """Detach a year from the table, its rows are kept in a standalone table."""
+    _alter_partition(table, year, db, 'ALTER TABLE {table} DETACH PARTITION {partition}', 'Detach', attached=True)
+
+
+def attach_partition(table, year, db='default'):
+    _alter_partition(table, year, db, ATTACH_PARTITION_SQL, 'Attach', attached=False)
+
+
+def truncate_partition(table, year, db='default'):
+    """Delete the rows of a year at once, e.g. before the year is reloaded.
+
+    Links of the other table to the deleted rows are cleared in the same transaction.
+    """
+    def unlink(connection, partition):
+        unlink_rows(connection, table, f'SELECT id FROM {partition}')
+
+    _alter_partition(table, year, db, 'TRUNCATE {partition}', 'Truncate', before=unlink)
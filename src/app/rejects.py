@@ -0,0 +1,77 @@
+import os
+import csv
+import json
+from collections import Counter
+from . import settings
+
+
+class RejectSink:
+    """Buffered writer of rejected rows to a JSONL or CSV file with counts by field and reason.
+
+    Rows rejected by the hooks are recorded with kind 'rejected', problems of lenient fields
+    which keep the row are recorded with kind 'warning'.
+    """
+    fieldnames = ['kind', 'file', 'row_no', 'field', 'reason', 'message', 'values']
+
+    def __init__(self, path, output_format='jsonl', buffer_size=10000):
+        self.path = path
+        self.output_format = output_format
+        self.buffer_size = buffer_size
+        self.counts = Counter()
+        self._buffer = []
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        if output_format == 'csv':
+            self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames)
+            self._writer.writeheader()
+
+    @classmethod
+    def for_file(cls, file_path, table=None, sheet=0, output_format='jsonl'):
+        base_name, _ = os.path.splitext(os.path.basename(file_path))
+        path = os.path.join(settings.REJECTS_DIR, f'{table or "rows"}-{sheet}-{base_name}.{output_format}')
+        return cls(path, output_format)
+
+    def add(self, file_path, row_no, exc, values=None, kind='rejected'):
+        fields = getattr(exc, 'fields', None) or ['']
+        reason = getattr(exc, 'reason', type(exc).__name__)
+        for field in fields:
+            self.counts[(kind, field, reason)] += 1
+        self._buffer.append({
+            'kind': kind,
+            'file': file_path,
+            'row_no': row_no,
+            'field': ','.join(fields),
+            'reason': reason,
+            'message': str(exc),
+            'values': values,
+        })
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        if self.output_format == 'csv':
+            self._writer.writerows(
+                dict(record, values=json.dumps(record['values'], default=str, ensure_ascii=False))
+                for record in self._buffer
+            )
+        else:
+            self._file.writelines(
+                json.dumps(record, default=str, ensure_ascii=False) + '\n' for record in self._buffer
+            )
+        self._buffer.clear()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def summary(self):
+        """Return counts as {'kind field reason': count}, most frequent first."""
+        return {f'{kind} {field} {reason}': count for (kind, field, reason), count in self.counts.most_common()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
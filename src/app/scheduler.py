@@ -0,0 +1,70 @@
+"""Concurrent execution of the transform steps along their table dependencies.
+
+Steps are declared in pipeline order with the tables they read and write. A step depends on
+every earlier step it conflicts with, one writing a table the other reads or writes, and
+independent steps run at the same time in worker threads, each on its own pooled connection.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def step_dependencies(steps):
+    """Return {step: set of earlier conflicting steps} of an ordered {step: {'reads', 'writes'}} mapping."""
+    dependencies = dict()
+    for index, (name, tables) in enumerate(steps.items()):
+        reads, writes = set(tables['reads']), set(tables['writes'])
+        dependencies[name] = {
+            earlier for earlier, earlier_tables in list(steps.items())[:index]
+            if writes & (set(earlier_tables['reads']) | set(earlier_tables['writes']))
+            or reads & set(earlier_tables['writes'])
+        }
+    return dependencies
+
+
+def run_steps(steps, run, workers=1):
+    """Call run(step) once the steps it depends on are done, with up to workers steps at a time.
+
+    Returns {step: (start, end)} in seconds since the schedule started. After a failure no step
+    is started, the running ones are awaited and the first error is raised.
+    """
+    dependencies = step_dependencies(steps)
+    pending = list(steps)
+    timings = dict()
+    errors = []
+    started = time.perf_counter()
+
+    def timed_run(name):
+        start = time.perf_counter() - started
+        run(name)
+        timings[name] = (start, time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = dict()
+        while pending or running:
+            if not errors:
+                for name in [name for name in pending if dependencies[name].issubset(timings)]:
+                    pending.remove(name)
+                    running[executor.submit(timed_run, name)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                if future.exception():
+                    errors.append(future.exception())
+    if errors:
+        raise errors[0]
+    return timings
+
+
+def critical_path(steps, timings):
+    """Return (steps, seconds) of the longest chain of dependent step durations."""
+    dependencies = step_dependencies(steps)
+    paths = dict()
+    for name in steps:
+        duration = timings[name][1] - timings[name][0]
+        path, seconds = max(
+            (paths[earlier] for earlier in dependencies[name]), key=lambda item: item[1], default=([], 0.0)
+        )
+        paths[name] = (path + [name], seconds + duration)
+    return max(paths.values(), key=lambda item: item[1], default=([], 0.0))
@@ -11,6 +11,25 @@ DATABASES = {
         'NAME': env.str('POSTGRES_DB'),
         'USER': env.str('POSTGRES_USER'),
         'PASSWORD': env.str('POSTGRES_PASSWORD'),
-        'OPTIONS': {},
+        # query options of the connection url, e.g. POSTGRES_OPTIONS=sslmode=require,connect_timeout=10
+        'OPTIONS': env.dict('POSTGRES_OPTIONS', default={}),
+        'POOL_SIZE': env.int('POSTGRES_POOL_SIZE', default=5),
+        'MAX_OVERFLOW': env.int('POSTGRES_MAX_OVERFLOW', default=10),
+        'POOL_PRE_PING': env.bool('POSTGRES_POOL_PRE_PING', default=True),
+        'POOL_RECYCLE': env.int('POSTGRES_POOL_RECYCLE', default=-1),
+        # psycopg2 executemany strategy of bulk inserts: 'values', 'batch' or None
+        'EXECUTEMANY_MODE': env.str('POSTGRES_EXECUTEMANY_MODE', default='values'),
+        'EXECUTEMANY_PAGE_SIZE': env.int('POSTGRES_EXECUTEMANY_PAGE_SIZE', default=1000),
+        # fetch query results through server side cursors by default
+        'STREAM_RESULTS': env.bool('POSTGRES_STREAM_RESULTS', default=False),
+        'APPLICATION_NAME': env.str('POSTGRES_APPLICATION_NAME', default='dwi-data-processing'),
+        # milliseconds, 0 disables the timeout
+        'STATEMENT_TIMEOUT': env.int('POSTGRES_STATEMENT_TIMEOUT', default=0),
     },
 }
+
+# Directory of the columnar staging cache written by `manage.py stage`
+STAGING_DIR = env.str('STAGING_DIR', default='staging')
+
+# Directory of the rejected rows files written by `manage.py load`
+REJECTS_DIR = env.str('REJECTS_DIR', default='rejects')
@@ -0,0 +1,121 @@
+"""Columnar staging cache of parsed workbooks.
+
+The rows produced by the loader tuple hooks are stored as typed NumPy columns in one .npz file
+per (table, sheet, layout fingerprint, source content hash), so later loads read the columns at
+disk speed instead of parsing the XLSX again. Stages written by another parser layout are not
+found, bump STAGE_VERSION when the parsing changes without a layout change.
+"""
+import os
+import glob
+import json
+import numpy as np
+from hashlib import blake2b
+from sqlalchemy import Integer, Float, Date, Boolean
+from . import settings
+from .manifest import file_hash
+
+
+STAGE_VERSION = 1
+
+
+def layout_fingerprint(layout):
+    """Return a short hash of the repr of a layout, e.g. the columns and parser fields of a table."""
+    return blake2b(repr((STAGE_VERSION, layout)).encode(), digest_size=8).hexdigest()
+
+
+def staged_path(file_path, table, sheet=0, layout=(), content_hash=None):
+    content_hash = content_hash or file_hash(file_path)
+    return os.path.join(settings.STAGING_DIR, f'{table}-{sheet}-{layout_fingerprint(layout)}-{content_hash}.npz')
+
+
+def find_stage(file_path, table, sheet=0, layout=()):
+    """Return the staged path of a file when it exists, the file is hashed only if the layout has stages."""
+    pattern = os.path.join(settings.STAGING_DIR, f'{table}-{sheet}-{layout_fingerprint(layout)}-*.npz')
+    if not glob.glob(pattern):
+        return None
+    path = staged_path(file_path, table, sheet, layout)
+    return path if os.path.exists(path) else None
+
+
+def column_kind(column):
+    if isinstance(column.type, Boolean):
+        return 'bool'
+    if isinstance(column.type, Integer):
+        return 'int'
+    if isinstance(column.type, Float):
+        return 'float'
+    if isinstance(column.type, Date):
+        return 'date'
+    return 'str'
+
+
+def _to_array(values, kind):
+    nulls = np.array([value is None for value in values], dtype=bool)
+    if kind == 'date':
+        return np.array(values, dtype='datetime64[D]'), nulls
+    fill = {'int': 0, 'float': 0.0, 'bool': False, 'str': ''}[kind]
+    if kind == 'str':
+        values = [fill if value is None else str(value) for value in values]
+    else:
+        values = [fill if value is None else value for value in values]
+    dtype = {'int': np.int64, 'float': np.float64, 'bool': bool, 'str': str}[kind]
+    return np.array(values, dtype=dtype), nulls
+
+
+def _to_values(array, nulls, kind):
+    if kind == 'date':
+        values = array.astype(object).tolist()
+    else:
+        values = array.tolist()
+    if nulls.any():
+        for idx in np.flatnonzero(nulls).tolist():
+            values[idx] = None
+    return values
+
+
+def write_stage(path, model_class, columns, rows, rejected=0, rejects_file=None, reasons=None):
+    """Write tuples ordered as columns, typed by the model columns, to a .npz file.
+
+    The rejects file and reason counts of the staging parse are kept to be reported by the loads
+    reading the stage.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    table_columns = model_class.__table__.columns
+    arrays = {
+        '__columns__': np.array(columns, dtype=str),
+        '__rejected__': np.array(rejected, dtype=np.int64),
+        '__rejects__': np.array(json.dumps({'rejects_file': rejects_file, 'reasons': reasons})),
+    }
+    for idx, column in enumerate(columns):
+        values = [row[idx] for row in rows]
+        arrays[column], arrays[f'{column}__null'] = _to_array(values, column_kind(table_columns[column]))
+    # write to a temporary file first, so a partial file is never taken for a cache hit
+    tmp_path = f'{path}.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_stage_rejects(path):
+    """Return {'rejects_file', 'reasons'} of a stage, None when its rejected rows were printed."""
+    with np.load(path) as data:
+        return json.loads(str(data['__rejects__']))
+
+
+def read_stage(path, model_class, chunk=2000):
+    """Yield (list of tuples, rejected row count) chunks from a .npz staging file.
+
+    The rejected count of the staged source is reported with the first chunk.
+    """
+    table_columns = model_class.__table__.columns
+    with np.load(path) as data:
+        columns = data['__columns__'].tolist()
+        rejected = int(data['__rejected__'])
+        values = [
+            _to_values(data[column], data[f'{column}__null'], column_kind(table_columns[column]))
+            for column in columns
+        ]
+    rows = list(zip(*values))
+    if not rows:
+        yield [], rejected
+    for idx in range(0, len(rows), chunk):
+        yield rows[idx:idx + chunk], rejected if idx == 0 else 0
@@ -0,0 +1,296 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from openpyxl import Workbook
+
+from benchmarks.parsers import Cell, generic_parse_accident_row, synthetic_accident_rows
+from .parsers import (
+    DataMissingError, DataValidationError, FAST_DATE_FORMATS, date_parser, parse_accident_row, parse_violation_row,
+    validate_uid,
+)
+from .matching import match_nearest
+from .transform import find_recidivist_ids
+from .validate import validate_file
+from .loader import parse_chunks, violation_row_to_tuple
+from .database.tests import ModelTest
+from .database.models import Accident, Violation
+
+
+def add_accident(session, uid, day, hour=0):
+    accident = Accident(
+        date=day, hour=hour, dead=0, injured=0, party_no=1, gender_no=1, uid=uid, country='臺北市',
+        town='中正區', car_type='C03', injury_level=1, driver_level=1, drunk_level=1, hit_and_run=0, job=1,
+    )
+    session.add(accident)
+    return accident
+
+
+def add_violation(session, uid, day):
+    violation = Violation(uid=uid, date=day)
+    session.add(violation)
+    return violation
+
+
+BAD_DATES = {
+    '%m/%d/%Y': ['1/2/80', '01/02/19800', '001/02/1980', '00/02/1980', '02/30/1980', '+1/02/1980',
+                 '\u0661/\u0662/\u0661\u0669\u0668\u0660', '13/01/1980', '0000/00/00', '01-02-1980', '01/02/1980/'],
+    '%Y/%m/%d': ['80/1/2', '1980/001/02', '1980/1/', '0000/00/00', '1980/02/30', '1980-01-02'],
+    '%Y-%m-%d': ['19-5-1', '2019-5-001', '2019/05/01', '2019-13-01', '-2019-05-01', '2019-05-01T00'],
+}
+
+
+def meta_parse_violation_row(row):
+    """The violation parser replaced by app.parsers, with the birthday kept None when invalid."""
+    uid, birthday, date_value = map(lambda idx: row[idx].value, [3, 4, 16])
+    if birthday == 'NULL':
+        birthday = None
+    invalid_fields = [name for name, value in (('uid', uid), ('date', date_value)) if not value]
+    if invalid_fields:
+        raise DataMissingError(invalid_fields)
+    if not validate_uid(uid):
+        raise DataValidationError('uid', f'invalid value {uid}')
+    try:
+        birthday = datetime.strptime(birthday, '%m/%d/%Y').date() if birthday else None
+    except ValueError:
+        birthday = None
+    if isinstance(date_value, datetime):
+        date_value = date_value.date()
+    else:
+        date_value = datetime.strptime(date_value, '%Y-%m-%d').date()
+    return {'uid': uid, 'birthday': birthday, 'date': date_value}
+
+
+class DateParserTest(unittest.TestCase):
+    """The fast date formats accept the strings strptime accepts."""
+
+    def test_same_as_strptime(self):
+        for date_format, bad in BAD_DATES.items():
+            parse = date_parser(date_format)
+            good = [date(1980, 1, 2).strftime(date_format), '1980-1-2', '1980/1/2', '1/2/1980', '1/ 2/1980', '12/31/1999']
+            for text in good + bad:
+                try:
+                    expected = datetime.strptime(text, date_format).date()
+                except ValueError:
+                    expected = None
+                with self.subTest(date_format=date_format, text=text):
+                    if expected is None:
+                        self.assertRaises(ValueError, parse, text)
+                    else:
+                        self.assertEqual(parse(text), expected)
+
+    def test_bad_dates_rejected(self):
+        for date_format, bad in BAD_DATES.items():
+            self.assertIn(date_format, FAST_DATE_FORMATS)
+            for text in bad:
+                with self.subTest(date_format=date_format, text=text):
+                    self.assertRaises(ValueError, date_parser(date_format), text)
+
+
+class ParseRowTest(unittest.TestCase):
+    """The compiled parsers return the fields of the meta loops they replaced."""
+
+    def assert_same(self, parse, meta_parse, row):
+        warnings = []
+        try:
+            expected = meta_parse(row)
+        except Exception as e:
+            # benchmarks.parsers raises the errors of app.parsers, imported apart from this package
+            with self.assertRaises(Exception) as raised:
+                parse(row, warnings.append)
+            self.assertEqual(type(raised.exception).__name__, type(e).__name__)
+            return
+        self.assertEqual(parse(row, warnings.append), expected)
+        return warnings
+
+    def test_accident_rows(self):
+        rows = synthetic_accident_rows(200)
+        for idx, text in enumerate(BAD_DATES['%m/%d/%Y']):
+            rows[idx][10] = Cell(text)
+        for idx, text in enumerate(BAD_DATES['%Y/%m/%d']):
+            rows[50 + idx][15] = Cell(text)
+        rows[100][13] = Cell('A12345678X')
+        rows[101][1] = Cell(None)
+        rows[102][1] = Cell('8')
+        for row in rows:
+            self.assert_same(parse_accident_row, generic_parse_accident_row, row)
+        self.assertEqual(len(self.assert_same(parse_accident_row, generic_parse_accident_row, rows[0])), 1)
+        self.assertEqual(self.assert_same(parse_accident_row, generic_parse_accident_row, rows[-1]), [])
+
+    def test_violation_rows(self):
+        values = [
+            ('A123456789', '01/02/1980', '2019-05-01'),
+            ('A123456789', None, datetime(2019, 5, 1, 8)),
+            ('A123456789', 'NULL', '2019-5-1'),
+            ('A123456789', '1/2/1980', '2019-05-01'),
+            (None, '01/02/1980', '2019-05-01'),
+            ('A12345678X', '01/02/1980', '2019-05-01'),
+            ('A123456789', '01/02/1980', None),
+        ] + [('A123456789', text, '2019-05-01') for text in BAD_DATES['%m/%d/%Y']]
+        for uid, birthday, date_value in values:
+            row = [Cell(None)] * 17
+            row[3], row[4], row[16] = Cell(uid), Cell(birthday), Cell(date_value)
+            with self.subTest(uid=uid, birthday=birthday, date=date_value):
+                self.assert_same(parse_violation_row, meta_parse_violation_row, row)
+
+    def test_bad_violation_date_rejected(self):
+        for text in BAD_DATES['%Y-%m-%d']:
+            row = [Cell(None)] * 17
+            row[3], row[16] = Cell('A123456789'), Cell(text)
+            with self.subTest(date=text):
+                self.assertRaises(ValueError, meta_parse_violation_row, row)
+                self.assertRaises(DataValidationError, parse_violation_row, row)
+
+
+class MatchNearestTest(unittest.TestCase):
+
+    def test_nearest_date_first(self):
+        accidents = [(1, 'A123456789', date(2019, 5, 10))]
+        violations = [(10, 'A123456789', date(2019, 5, 12)), (11, 'A123456789', date(2019, 5, 9))]
+        self.assertEqual(match_nearest(accidents, violations, tolerance=2), [(1, 11)])
+
+    def test_same_day_ties(self):
+        # equal distances are resolved by accident id, then violation id, each side used once
+        day = date(2019, 5, 1)
+        accidents = [(2, 'A123456789', day), (1, 'A123456789', day)]
+        violations = [(11, 'A123456789', day), (10, 'A123456789', day)]
+        self.assertEqual(match_nearest(accidents, violations), [(1, 10), (2, 11)])
+
+    def test_tie_between_earlier_and_later_violation(self):
+        accidents = [(1, 'A123456789', date(2019, 5, 10))]
+        violations = [(11, 'A123456789', date(2019, 5, 11)), (10, 'A123456789', date(2019, 5, 9))]
+        self.assertEqual(match_nearest(accidents, violations, tolerance=1), [(1, 10)])
+
+    def test_taken_violation_falls_back_to_next_nearest(self):
+        accidents = [(1, 'A123456789', date(2019, 5, 10)), (2, 'A123456789', date(2019, 5, 11))]
+        violations = [(10, 'A123456789', date(2019, 5, 10)), (11, 'A123456789', date(2019, 5, 13))]
+        self.assertEqual(match_nearest(accidents, violations, tolerance=2), [(1, 10), (2, 11)])
+
+    def test_other_uid_or_out_of_tolerance(self):
+        accidents = [(1, 'A123456789', date(2019, 5, 10))]
+        violations = [(10, 'B123456789', date(2019, 5, 10)), (11, 'A123456789', date(2019, 5, 13))]
+        self.assertEqual(match_nearest(accidents, violations, tolerance=2), [])
+
+
+class FindRecidivistIdsTest(unittest.TestCase):
+
+    def find(self, rows, interval):
+        uids, dates, ids = zip(*rows)
+        return find_recidivist_ids(
+            np.array(uids, dtype=str), np.array(dates, dtype='datetime64[D]'), np.array(ids, dtype=np.int64),
+            interval
+        ).tolist()
+
+    def test_gap_mask(self):
+        start = date(2015, 1, 1)
+        rows = [
+            ('A123456789', start + timedelta(400), 3),
+            ('A123456789', start, 1),
+            ('A123456789', start + timedelta(100), 2),
+            ('B123456789', start + timedelta(150), 4),
+            ('B123456789', start + timedelta(251), 5),
+        ]
+        # gaps of exactly the interval count, the first violation of a uid never does
+        self.assertEqual(sorted(self.find(rows, interval=100)), [2])
+        self.assertEqual(sorted(self.find(rows, interval=300)), [2, 3, 5])
+
+    def test_same_day_is_recidivist_after_lower_id(self):
+        day = date(2015, 1, 1)
+        rows = [('A123456789', day, 8), ('A123456789', day, 7)]
+        self.assertEqual(self.find(rows, interval=0), [8])
+
+    def test_uid_boundary(self):
+        day = date(2015, 1, 1)
+        rows = [('A123456789', day, 1), ('B123456789', day, 2)]
+        self.assertEqual(self.find(rows, interval=365), [])
+
+
+class ValidateFileTest(unittest.TestCase):
+    """validate_file rejects the rows parse_chunks rejects."""
+
+    def violation_row(self, uid, birthday, day):
+        row = [None] * 17
+        row[3], row[4], row[16] = uid, birthday, day
+        return row
+
+    def test_rejected_count_matches_loader(self):
+        rows = [
+            self.violation_row('A123456789', '05/01/1980', '2019-05-01'),
+            self.violation_row('A123456789', None, datetime(2019, 5, 2)),
+            self.violation_row(' A123456789 ', 'NULL', '2019-05-03'),
+            self.violation_row('A123456789', '13/45/1980', '2019-05-04'),
+            self.violation_row(None, '05/01/1980', '2019-05-05'),
+            self.violation_row('a123456789', '05/01/1980', '2019-05-06'),
+            self.violation_row('A12345678X', '05/01/1980', '2019-05-07'),
+            self.violation_row(123456789, '05/01/1980', '2019-05-08'),
+            self.violation_row('A123456789', '05/01/1980', '2019/05/09'),
+            self.violation_row('A123456789', '05/01/1980', ''),
+            self.violation_row('A123456789', 'unknown', 20190510),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'violation.xlsx')
+            wb = Workbook()
+            wb.active.append(['header'] * 17)
+            for row in rows:
+                wb.active.append(row)
+            wb.save(file_path)
+
+            warnings = []
+            loaded = rejected = 0
+            for data, chunk_rejected in parse_chunks(
+                file_path, lambda row, report: violation_row_to_tuple(row, warnings.append), chunk=4
+            ):
+                loaded += len(data)
+                rejected += chunk_rejected
+            report = validate_file(file_path, 'violation')
+
+        self.assertEqual((loaded, rejected), (4, 7))
+        self.assertEqual(report['rows'], len(rows))
+        self.assertEqual(report['rejected'], rejected)
+        self.assertEqual(report['reasons'].get('warning birthday invalid'), len(warnings))
+
+
+class MatchViolationSqlTest(ModelTest):
+    """The server side matcher links the same pairs as matching.match_nearest."""
+
+    def assert_same_pairs(self, accidents, violations, tolerance):
+        from .transform_sql import match_violations
+        self.session.flush()
+        expected = match_nearest(
+            [(a.id, a.uid, a.date) for a in accidents], [(v.id, v.uid, v.date) for v in violations], tolerance
+        )
+        match_violations(self.session, tolerance)
+        ids = [a.id for a in accidents]
+        pairs = self.session.query(Accident.id, Accident.violation_id).filter(
+            Accident.id.in_(ids), Accident.violation_id.isnot(None)
+        ).all()
+        self.assertEqual(sorted(pairs), sorted(expected))
+        return pairs
+
+    def test_same_day_ties(self):
+        day = date(2019, 5, 1)
+        accidents = [add_accident(self.session, 'Z900000001', day, hour) for hour in (8, 9)]
+        violations = [add_violation(self.session, 'Z900000001', day) for _ in range(2)]
+        pairs = self.assert_same_pairs(accidents, violations, tolerance=0)
+        self.assertEqual(len(pairs), 2)
+
+    def test_random_dates(self):
+        rng = random.Random(0)
+        start = date(2019, 1, 1)
+        uids = [f'Z9100000{i:02d}' for i in range(10)]
+        # distinct hours keep (uid, date, hour) unique
+        accidents = [
+            add_accident(self.session, rng.choice(uids), start + timedelta(rng.randrange(20)), hour)
+            for hour in range(80)
+        ]
+        violations = [
+            add_violation(self.session, rng.choice(uids), start + timedelta(rng.randrange(20))) for _ in range(60)
+        ]
+        self.assert_same_pairs(accidents, violations, tolerance=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,55 +1,26 @@
+import numpy as np
 from datetime import datetime
-from hashlib import blake2b
-from sqlalchemy import or_, and_, extract
 from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy import func
-from .database.utils import session_scope
-from .database.models import Violation, Accident, CountryTown, Divorce, Old, Indigenous, Education, IncomeMid, IncomeAvg
-
-
-def country_town_old_to_new(country, town):
-    country = country.replace('台', '臺')
-    town = town.replace('台', '臺')
-    if country in ('臺中縣', '臺南縣', '高雄縣', '桃園縣'):
-        return country.replace('縣', '市'), town[:-1] + '區'
-    if country == '臺北縣':
-        return '新北市', town[:-1] + '區'
-    return country, town
+from .hashing import uid_hasher
+from .matching import match_violations
+from .export import TABLES_EXPORT_SELECT_SQL
+from .checkpoint import checkpointed_chunks
+from .database.utils import session_scope, copy_temp_table
+from .partition import ensure_missing_violation_partitions
+from .database.models import Violation, Accident
+from . import transform_sql
 
 
 def patch_party_address_from_accident():
-    """If party address fields are not complete, patch from accident address."""
+    """If party address fields are not complete, patch from accident address.
 
-    # create lookup mapping
-    with session_scope() as s:
-        map_qs = s.query(CountryTown.code, CountryTown.country, CountryTown.town).distinct()
+    The server side step is a single joined update on address_alias, it serves both implementations.
+    """
+    return transform_sql.patch_party_address_from_accident()
 
-    mapping = {
-        country+town: code for code, country, town in map_qs
-    }
 
-    with session_scope() as s:
-        qs = s.query(Accident).filter(
-            or_(
-                Accident.party_country.is_(None),
-                Accident.party_town.is_(None)
-            )
-        )
-        for obj in qs:
-            country, town = country_town_old_to_new(obj.country, obj.town)
-            lookup_key = f'{country}{town}'
-            lookup_code = mapping.get(lookup_key, None)
-            if lookup_code:
-                obj.party_address_code = lookup_code
-                obj.party_country = country
-                obj.party_town = town
-                obj.is_party_address_patched = True
-
-        # bulk update
-        s.flush()
-
-
-def patch_birthday_from_violation():
+def patch_birthday_from_violation(chunk=1000, stream=False):
     with session_scope() as s:
         qs = s.query(Violation.uid, Violation.birthday).filter(
             Violation.birthday.isnot(None),
@@ -59,17 +30,12 @@ def patch_birthday_from_violation():
         uid: birthday for uid, birthday in data
     }
     with session_scope() as s:
-        accident_count = s.query(Accident).count()
-    chunk = 1000
-    with session_scope() as s:
-        for idx in range(0, accident_count, chunk):
-            accidents = s.query(Accident).filter(Accident.id.between(idx, idx + chunk)).all()
+        qs = s.query(Accident)
+        for accidents in checkpointed_chunks(s, 'patch_birthday_from_violation.accident', qs, Accident.id, chunk, stream):
             for accident in accidents:
                 birthday = mapping.get(accident.uid)
                 if birthday:
                     accident.birthday = birthday
-            # bulk update
-            s.flush()
 
     # Update accidents which cannot find birthday from violation, use first day in birth month
     with session_scope() as s:
@@ -85,50 +51,15 @@ def patch_birthday_from_violation():
 
 
 def patch_missing_violation(tolerance=0):
-    # stage 1: link the accident, violation with same date
-    with session_scope() as s:
-        qs = s.query(Accident, Violation).filter(
-            Accident.violation_id.is_(None),
-            Violation.accident_id.is_(None),
-            Accident.uid == Violation.uid,
-            Violation.date == Accident.date,
-        )
-    chunk = 1000
-    data = list(qs)
-    print(f'Associate Accident, Violation by same uid and date, match count: {len(data)}.')
-    with session_scope() as s:
-        for idx in range(0, len(data), chunk):
-            for accident, violation in data[idx:idx+chunk]:
-                accident.violation_id = violation.id
-                violation.accident_id = accident.id
-            # bulk update
-            s.flush()
-
-    # stage 2: link the accident, violation in tolerance delta days
-    for i in range(1, tolerance + 1):
-        with session_scope() as s:
-            qs = s.query(Accident, Violation).filter(
-                Accident.violation_id.is_(None),
-                Violation.accident_id.is_(None),
-                Accident.uid == Violation.uid,
-                or_(
-                    Violation.date == Accident.date + i,
-                    Violation.date == Accident.date - i,
-                )
-            ).order_by()
-        data = list(qs)
-        print(f'Associate Accident, Violation by same uid and {i} delta day, match count: {len(data)}.')
-        with session_scope() as s:
-            for accident, violation in data:
-                accident.violation_id = violation.id
-                violation.accident_id = accident.id
-            # bulk update
-            s.flush()
+    # stage 1, 2: link the accident, violation with nearest date in tolerance delta days
+    match_violations(tolerance)
 
-    # stage 3.1: create missing violations
+    # stage 3.1: create missing violations, skipping those created by an interrupted run
+    ensure_missing_violation_partitions()
     with session_scope() as s:
         qs = s.query(Accident).filter(
             Accident.violation_id.is_(None),
+            ~s.query(Violation).filter(Violation.accident_id == Accident.id).exists(),
         )
     data = list(qs)
     violations = [
@@ -162,7 +93,11 @@ def patch_missing_violation(tolerance=0):
         s.query(Violation).filter(Violation.is_patched.is_(None)).update({Violation.is_patched: False})
 
 
-def calculate_recidivist():
+def calculate_recidivist(interval=365 * 5, vectorized=True):
+    """Flag violations committed within interval days after the previous one of the same uid."""
+    if vectorized:
+        return calculate_recidivist_vectorized(interval)
+
     true_data_pks = list()
     with session_scope() as s:
         qs = s.query(
@@ -179,7 +114,7 @@ def calculate_recidivist():
             for i in range(1, len(dates)):
                 previous, current = dates[i-1:i+1]
                 # if intervals less than 5 year, push to true_data
-                if (current - previous).days <= 365*5:
+                if (current - previous).days <= interval:
                     # push pk
                     true_data_pks.append(pks[i])
 
@@ -198,13 +133,48 @@ def calculate_recidivist():
         ])
 
 
-def calculate_age():
+def find_recidivist_ids(uids, dates, ids, interval=365 * 5):
+    """Return ids of violations within interval days after the previous violation of the same uid.
+
+    Arrays are sorted by (uid, date, id) and consecutive rows are compared with diff masks.
+    """
+    order = np.lexsort((ids, dates, uids))
+    uids, dates, ids = uids[order], dates[order], ids[order]
+    mask = np.zeros(len(ids), dtype=bool)
+    mask[1:] = (uids[1:] == uids[:-1]) & (np.diff(dates).astype(np.int64) <= interval)
+    return ids[mask]
+
+
+def calculate_recidivist_vectorized(interval=365 * 5):
     with session_scope() as s:
-        accident_count = s.query(Accident).count()
-    chunk = 1000
+        rows = s.query(Violation.uid, Violation.date, Violation.id).all()
+        if not rows:
+            return
+        uids, dates, ids = zip(*rows)
+        pks = find_recidivist_ids(
+            np.array(uids, dtype=str),
+            np.array(dates, dtype='datetime64[D]'),
+            np.array(ids, dtype=np.int64),
+            interval
+        )
+        print(f'Unique user count: {len(set(uids))}')
+        print(f'True data count: {len(pks)}')
+
+        # Update database field in one pass, only rows whose flag changes are written
+        copy_temp_table(s, 'recidivist', 'id INTEGER PRIMARY KEY', ((int(pk), ) for pk in pks))
+        s.execute(
+            'UPDATE violation SET is_recidivist = flags.is_recidivist '
+            'FROM (SELECT violation.id, recidivist.id IS NOT NULL AS is_recidivist '
+            'FROM violation LEFT JOIN recidivist ON recidivist.id = violation.id) AS flags '
+            'WHERE violation.id = flags.id AND violation.is_recidivist IS DISTINCT FROM flags.is_recidivist'
+        )
+
+
+def calculate_age(chunk=1000, stream=False):
+    count = 0
     with session_scope() as s:
-        for idx in range(0, accident_count, chunk):
-            accidents = s.query(Accident).filter(Accident.id.between(idx, idx + chunk)).all()
+        qs = s.query(Accident)
+        for accidents in checkpointed_chunks(s, 'calculate_age.accident', qs, Accident.id, chunk, stream):
             for accident in accidents:
                 if accident.birthday:
                     age = int((accident.date - accident.birthday).days / 365.2425)
@@ -222,52 +192,25 @@ def calculate_age():
                         age_group = 6
                     accident.age = age
                     accident.age_group = age_group
-            # bulk update
-            s.flush()
+                    count += 1
+    return count
 
 
 def get_output_query():
-    with session_scope() as s:
-        qs = s.query(Accident, Violation, Divorce.rate, Old.rate, Indigenous.rate, Education.rate, Income.rate).filter(
-            Accident.violation_id == Violation.id
-        ).outerjoin(
-            Divorce,
-            and_(extract('year', Accident.date) == Divorce.year, Accident.party_address_code == Divorce.address_code)
-        ).outerjoin(
-            Old,
-            and_(extract('year', Accident.date) == Old.year, Accident.party_address_code == Old.address_code)
-        ).outerjoin(
-            Indigenous,
-            and_(extract('year', Accident.date) == Indigenous.year, Accident.party_address_code == Indigenous.address_code)
-        ).outerjoin(
-            Education,
-            and_(extract('year', Accident.date) == Education.year, Accident.party_address_code == Education.address_code)
-        ).outerjoin(
-            IncomeMid,
-            and_(extract('year', Accident.date) == IncomeMid.year, Accident.party_address_code == IncomeMid.address_code)
-        ).outerjoin(
-            IncomeAvg,
-            and_(extract('year', Accident.date) == IncomeAvg.year, Accident.party_address_code == IncomeAvg.address_code)
-        )
-        return str(qs)
+    """Return the SQL of the analytical export, materialized by app.export."""
+    return TABLES_EXPORT_SELECT_SQL
 
 
-def encrypt_uid():
-    with session_scope() as s:
-        accident_count = s.query(Accident).count()
-        violation_count = s.query(Violation).count()
-    chunk = 1000
-    with session_scope() as s:
-        for idx in range(0, accident_count, chunk):
-            accidents = s.query(Accident).filter(Accident.id.between(idx, idx + chunk)).all()
-            for accident in accidents:
-                accident.uid = 'I-' + blake2b(accident.uid.encode('utf-8'), digest_size=5).hexdigest()
-            # bulk update
-            s.flush()
-    with session_scope() as s:
-        for idx in range(0, violation_count, chunk):
-            violations = s.query(Violation).filter(Violation.id.between(idx, idx + chunk)).all()
-            for violation in violations:
-                violation.uid = 'I-' + blake2b(violation.uid.encode('utf-8'), digest_size=5).hexdigest()
-            # bulk update
-            s.flush()
+def encrypt_uid(chunk=1000, stream=False):
+    """Hash the uids of both tables chunk by chunk, uids prefixed with 'I-' are already encrypted."""
+    count = 0
+    for model_class in (Accident, Violation):
+        with session_scope() as s:
+            name = f'encrypt_uid.{model_class.__tablename__}'
+            qs = s.query(model_class).filter(~model_class.uid.startswith('I-'))
+            for instances in checkpointed_chunks(s, name, qs, model_class.id, chunk, stream):
+                for instance in instances:
+                    instance.uid = uid_hasher.hash(instance.uid)
+                count += len(instances)
+    print(f'Uid hash cache: {uid_hasher.stats()}')
+    return count
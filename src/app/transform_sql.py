@@ -0,0 +1,187 @@
+"""Server side implementations of the transform steps.
+
+Each step is expressed as set based statements executed inside PostgreSQL instead of
+loading ORM objects into python, the results match the steps in transform.py.
+"""
+from .hashing import uid_hasher
+from .address import ensure_address_aliases
+from .partition import ensure_missing_violation_partitions
+from .database.utils import session_scope, copy_temp_table
+
+
+PATCH_PARTY_ADDRESS_SQL = """
+UPDATE accident
+SET party_address_code = address_alias.code,
+    party_country = address_alias.country,
+    party_town = address_alias.town,
+    is_party_address_patched = TRUE
+FROM address_alias
+WHERE (accident.party_country IS NULL OR accident.party_town IS NULL)
+    AND address_alias.raw_country = accident.country AND address_alias.raw_town = accident.town
+"""
+
+CALCULATE_AGE_SQL = """
+WITH ages AS (
+    SELECT id, CAST(trunc((date - birthday) / 365.2425) AS INTEGER) AS age
+    FROM accident
+    WHERE birthday IS NOT NULL
+)
+UPDATE accident
+SET age = ages.age,
+    age_group = CASE
+        WHEN ages.age >= 15 AND ages.age < 25 THEN 1
+        WHEN ages.age >= 25 AND ages.age < 35 THEN 2
+        WHEN ages.age >= 35 AND ages.age < 45 THEN 3
+        WHEN ages.age >= 45 AND ages.age < 55 THEN 4
+        WHEN ages.age >= 55 AND ages.age < 65 THEN 5
+        WHEN ages.age > 65 THEN 6
+    END
+FROM ages
+WHERE accident.id = ages.id
+"""
+
+# Pair unlinked accidents and violations of the same uid which rank each other first, by
+# date distance then id. A pair blocked by a closer one is found by the next round once the
+# closer pair is linked, rounds repeat until none links, like matching.match_nearest.
+MATCH_VIOLATION_SQL = """
+CREATE TEMP TABLE violation_match ON COMMIT DROP AS
+SELECT accident_id, violation_id
+FROM (
+    SELECT
+        accident.id AS accident_id,
+        violation.id AS violation_id,
+        row_number() OVER (
+            PARTITION BY accident.id ORDER BY abs(violation.date - accident.date), violation.id
+        ) AS accident_rank,
+        row_number() OVER (
+            PARTITION BY violation.id ORDER BY abs(violation.date - accident.date), accident.id
+        ) AS violation_rank
+    FROM accident
+    JOIN violation ON violation.uid = accident.uid
+    WHERE accident.violation_id IS NULL
+        AND violation.accident_id IS NULL
+        AND violation.date BETWEEN accident.date - :tolerance AND accident.date + :tolerance
+) AS candidates
+WHERE accident_rank = 1 AND violation_rank = 1
+"""
+
+LINK_ACCIDENT_SQL = """
+UPDATE accident SET violation_id = violation_match.violation_id
+FROM violation_match
+WHERE accident.id = violation_match.accident_id
+"""
+
+LINK_VIOLATION_SQL = """
+UPDATE violation SET accident_id = violation_match.accident_id
+FROM violation_match
+WHERE violation.id = violation_match.violation_id
+"""
+
+CREATE_MISSING_VIOLATION_SQL = """
+INSERT INTO violation (id, uid, date, accident_id, is_patched)
+SELECT nextval('violate_id_seq'), uid, date, id, TRUE
+FROM accident
+WHERE violation_id IS NULL
+ORDER BY id
+"""
+
+LINK_CREATED_VIOLATION_SQL = """
+UPDATE accident SET violation_id = violation.id
+FROM violation
+WHERE accident.violation_id IS NULL AND violation.accident_id = accident.id
+"""
+
+DEFAULT_IS_PATCHED_SQL = """
+UPDATE violation SET is_patched = FALSE WHERE is_patched IS NULL
+"""
+
+DISTINCT_UID_SQL = """
+SELECT uid FROM accident WHERE uid NOT LIKE 'I-%'
+UNION
+SELECT uid FROM violation WHERE uid NOT LIKE 'I-%'
+"""
+
+# A violation is recidivist when the previous violation of the same uid is within interval days.
+CALCULATE_RECIDIVIST_SQL = """
+UPDATE violation SET is_recidivist = gaps.is_recidivist
+FROM (
+    SELECT id, COALESCE(date - lag(date) OVER (PARTITION BY uid ORDER BY date, id) <= :interval, FALSE)
+        AS is_recidivist
+    FROM violation
+) AS gaps
+WHERE violation.id = gaps.id AND violation.is_recidivist IS DISTINCT FROM gaps.is_recidivist
+"""
+
+ENCRYPT_UID_SQL = """
+UPDATE {table} SET uid = uid_mapping.new_uid
+FROM uid_mapping
+WHERE {table}.uid = uid_mapping.uid
+"""
+
+
+def patch_party_address_from_accident():
+    """If party address fields are not complete, patch from accident address."""
+    with session_scope() as s:
+        ensure_address_aliases(s)
+        result = s.execute(PATCH_PARTY_ADDRESS_SQL)
+        print(f'Patch party address, update count: {result.rowcount}.')
+        return result.rowcount
+
+
+def calculate_age():
+    with session_scope() as s:
+        result = s.execute(CALCULATE_AGE_SQL)
+        print(f'Calculate age, update count: {result.rowcount}.')
+        return result.rowcount
+
+
+def match_violations(session, tolerance=0):
+    """Link accidents and violations in rounds of mutually nearest pairs, return the match count."""
+    count = 0
+    while True:
+        session.execute(MATCH_VIOLATION_SQL, {'tolerance': tolerance})
+        session.execute(LINK_ACCIDENT_SQL)
+        linked = session.execute(LINK_VIOLATION_SQL).rowcount
+        session.execute('DROP TABLE violation_match')
+        if not linked:
+            return count
+        count += linked
+
+
+def patch_missing_violation(tolerance=0):
+    ensure_missing_violation_partitions()
+    with session_scope() as s:
+        count = match_violations(s, tolerance)
+        print(f'Associate Accident, Violation in {tolerance} delta days, match count: {count}.')
+        result = s.execute(CREATE_MISSING_VIOLATION_SQL)
+        print(f'Create missing violation count: {result.rowcount}.')
+        s.execute(LINK_CREATED_VIOLATION_SQL)
+        s.execute(DEFAULT_IS_PATCHED_SQL)
+
+
+def calculate_recidivist(interval=365 * 5):
+    with session_scope() as s:
+        result = s.execute(CALCULATE_RECIDIVIST_SQL, {'interval': interval})
+        print(f'Calculate recidivist, update count: {result.rowcount}.')
+        return result.rowcount
+
+
+def encrypt_uid(processes=None):
+    """Hash each distinct uid once in python, then rewrite both tables with joined updates.
+
+    Hashing goes through the shared uid hasher, a process pool is used for huge batches
+    when processes is given. PostgreSQL has no blake2b, the uid mapping is copied into a temporary table instead.
+    Uids already prefixed with 'I-' are treated as encrypted and left untouched.
+    """
+    with session_scope() as s:
+        uids = [uid for uid, in s.execute(DISTINCT_UID_SQL)]
+        copy_temp_table(
+            s, 'uid_mapping', 'uid VARCHAR(30) PRIMARY KEY, new_uid VARCHAR(12)',
+            zip(uids, uid_hasher.hash_many(uids, processes=processes))
+        )
+        count = 0
+        for table in ('accident', 'violation'):
+            result = s.execute(ENCRYPT_UID_SQL.format(table=table))
+            print(f'Encrypt {table} uid, update count: {result.rowcount}.')
+            count += result.rowcount
+    return count
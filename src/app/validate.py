@@ -0,0 +1,171 @@
+"""Quality checks of source workbooks without a database.
+
+Sheets are read as plain values and checked a column at a time against the parser layouts of
+app.parsers: null counts of every field, types, uids with array comparisons and string dates
+once per distinct value. The rows counted as rejected are the rows a load would reject.
+"""
+import time
+import numpy as np
+from collections import Counter, defaultdict
+from multiprocessing import Pool
+from more_itertools import chunked
+from openpyxl import load_workbook
+from .parsers import ACCIDENT_LAYOUT, VIOLATION_LAYOUT, date_parser
+
+
+LAYOUTS = {
+    'accident': ACCIDENT_LAYOUT,
+    'violation': VIOLATION_LAYOUT,
+}
+
+UID_LENGTH = 10
+
+# row numbers kept per issue in the report
+SAMPLE_SIZE = 5
+
+
+def clean(value):
+    if value.__class__ is str:
+        value = value.strip()
+        if value == '' or value == 'NULL':
+            return None
+    return value
+
+
+def valid_uids(uids):
+    """Return a boolean array of the strings matching parsers.uid_pattern, '^[A-Z][0-9]{9}$'.
+
+    Strings are laid out as fixed width code points, longer ones are cut one past the uid
+    length so they still fail the length check.
+    """
+    array = np.array(uids, dtype=f'U{UID_LENGTH + 1}')
+    codes = array.view(np.uint32).reshape(len(uids), UID_LENGTH + 1)
+    digits = codes[:, 1:UID_LENGTH]
+    return (
+        (np.char.str_len(array) == UID_LENGTH)
+        & (codes[:, 0] >= ord('A')) & (codes[:, 0] <= ord('Z'))
+        & ((digits >= ord('0')) & (digits <= ord('9'))).all(axis=1)
+    )
+
+
+def read_columns(file_path, layout, skip_first=True, sheet=0, chunk=50000):
+    """Yield chunks of the sheet as {field name: list of cleaned values}."""
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        rows = wb.worksheets[sheet].iter_rows(min_row=2 if skip_first else 1, values_only=True)
+        for data in chunked(rows, chunk):
+            yield {
+                field.name: [clean(row[field.index]) if len(row) > field.index else None for row in data]
+                for field in layout
+            }
+    finally:
+        wb.close()
+
+
+def check_columns(columns, layout, uid_field='uid'):
+    """Return ({(kind, field, reason): boolean mask}, {field: null count}) of a chunk."""
+    issues = dict()
+    nulls = dict()
+    for field in layout:
+        values = columns[field.name]
+        types = field.type if isinstance(field.type, tuple) else (field.type, )
+        missing = np.fromiter((value is None for value in values), bool, len(values))
+        nulls[field.name] = int(missing.sum())
+        if field.required:
+            issues[('rejected', field.name, 'missing')] = missing
+        issues[('rejected', field.name, 'type')] = np.fromiter(
+            (value is not None and value.__class__ not in types for value in values), bool, len(values)
+        )
+        if field.name == uid_field:
+            indexes = [idx for idx, value in enumerate(values) if value.__class__ is str]
+            invalid = np.zeros(len(values), bool)
+            if indexes:
+                invalid[np.array(indexes)[~valid_uids([values[idx] for idx in indexes])]] = True
+            issues[('rejected', field.name, 'invalid')] = invalid
+        if field.date_format:
+            parse = date_parser(field.date_format)
+            bad = set()
+            for value in {value for value in values if value.__class__ is str}:
+                try:
+                    parse(value)
+                except (ValueError, TypeError):
+                    bad.add(value)
+            kind = 'warning' if field.lenient else 'rejected'
+            issues[(kind, field.name, 'invalid')] = np.fromiter(
+                (value in bad for value in values), bool, len(values)
+            ) if bad else np.zeros(len(values), bool)
+    return issues, nulls
+
+
+def validate_file(file_path, table, skip_first=True, sheet=0):
+    """Return the quality report of a workbook, errors reading it are reported instead of raised."""
+    layout = LAYOUTS[table]
+    start = time.perf_counter()
+    rows = rejected = 0
+    counts = Counter()
+    samples = defaultdict(list)
+    nulls = Counter()
+    try:
+        for columns in read_columns(file_path, layout, skip_first, sheet):
+            size = len(columns[layout[0].name])
+            issues, chunk_nulls = check_columns(columns, layout)
+            rejects = np.zeros(size, bool)
+            for (kind, _, _), mask in issues.items():
+                if kind == 'rejected':
+                    rejects |= mask
+            for key, mask in issues.items():
+                if key[0] == 'warning':
+                    # the loader stops at the first error of a row, warnings of rejected rows are not seen
+                    mask = mask & ~rejects
+                indexes = np.flatnonzero(mask)
+                if not len(indexes):
+                    continue
+                counts[key] += len(indexes)
+                if len(samples[key]) < SAMPLE_SIZE:
+                    first_row_no = rows + 1 + int(skip_first)
+                    samples[key] += (indexes[:SAMPLE_SIZE - len(samples[key])] + first_row_no).tolist()
+            nulls.update(chunk_nulls)
+            rows += size
+            rejected += int(rejects.sum())
+    except Exception as e:
+        return {'file': file_path, 'rows': rows, 'rejected': rejected, 'error': f'{type(e).__name__}: {e}'}
+    return {
+        'file': file_path,
+        'rows': rows,
+        'rejected': rejected,
+        'seconds': round(time.perf_counter() - start, 3),
+        'reasons': {f'{kind} {field} {reason}': count for (kind, field, reason), count in counts.most_common()},
+        'samples': {f'{kind} {field} {reason}': row_nos for (kind, field, reason), row_nos in samples.items()},
+        'nulls': dict(nulls),
+    }
+
+
+def validate_files(file_paths, table, sheet=0, processes=None):
+    """Validate files with a process pool, return the reports in the order of the given paths."""
+    if table not in LAYOUTS:
+        raise ValueError(f"Table {table} has no layout to validate, choose one of {', '.join(LAYOUTS)}.")
+    arguments = [(file_path, table, True, sheet) for file_path in file_paths]
+    if processes == 1 or len(file_paths) <= 1:
+        return [validate_file(*argument) for argument in arguments]
+    with Pool(processes=processes) as pool:
+        return pool.starmap(validate_file, arguments, chunksize=1)
+
+
+def print_validation_report(reports):
+    for report in reports:
+        line = f"file={report['file']} | rows={report['rows']} | rejected={report['rejected']}"
+        if report.get('error'):
+            line += f" | error={report['error']}"
+        else:
+            line += f" | seconds={report['seconds']}"
+        print(line)
+        for reason, count in report.get('reasons', {}).items():
+            print(f"    {reason}: {count} | rows={','.join(map(str, report['samples'][reason]))}")
+        nulls = ', '.join(f'{field}={count}' for field, count in report.get('nulls', {}).items() if count)
+        if nulls:
+            print(f'    nulls: {nulls}')
+    print(
+        f"Total files={len(reports)} | rows={sum(report['rows'] for report in reports)} | "
+        f"rejected={sum(report['rejected'] for report in reports)} | "
+        f"failed={sum(1 for report in reports if report.get('error'))}"
+    )
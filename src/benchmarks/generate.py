@@ -0,0 +1,177 @@
+"""Synthetic DWI workbooks shaped like the confidential sources mounted at /data.
+
+    python -m benchmarks.generate --output-dir /tmp/dwi --accidents 100000
+
+Writes Accident_0701.xlsx, ObeyLaw0624/*.xlsx and the region rate workbooks used by the init
+scripts. People have valid or invalid uids, offenders repeat with a heavy tailed count, some
+accidents carry pre 2010 county names and some violations share the date of an accident.
+"""
+import os
+import random
+import argparse
+from datetime import datetime, timedelta
+from openpyxl import Workbook
+
+
+# (new country, old country, town suffix before the 2010 mergers, code prefix, towns)
+COUNTRIES = [
+    ('臺北市', None, None, '63000', ['松山區', '信義區', '大安區', '中山區', '中正區', '大同區', '萬華區', '文山區']),
+    ('新北市', '臺北縣', '市', '65000', ['板橋區', '三重區', '中和區', '永和區', '新莊區', '新店區', '土城區']),
+    ('桃園市', '桃園縣', '市', '68000', ['桃園區', '中壢區', '平鎮區', '八德區']),
+    ('臺中市', '臺中縣', '鎮', '66000', ['豐原區', '東勢區', '大甲區', '清水區', '沙鹿區']),
+    ('臺南市', '臺南縣', '鎮', '67000', ['新營區', '鹽水區', '白河區', '麻豆區']),
+    ('高雄市', '高雄縣', '鄉', '64000', ['鳳山區', '林園區', '大寮區', '大樹區']),
+    ('基隆市', None, None, '10017', ['仁愛區', '信義區', '中正區']),
+]
+
+# workbook name, tables of its sheets
+REGION_FILES = [
+    ('01_divorce_r.xlsx', ['divorce']),
+    ('02_old_r.xlsx', ['old']),
+    ('03_Indgnus_r.xlsx', ['indigenous']),
+    ('04_highedu_r.xlsx', ['education']),
+    ('05_income_r.xlsx', ['income_mid', 'income_avg']),
+]
+
+UID_LETTERS = 'ABCDEFGHJKLMNPQRSTUVXYWZIO'
+
+
+def country_towns():
+    """Return (country, town, code, old country, old town) of every town."""
+    items = []
+    for country, old_country, old_suffix, prefix, towns in COUNTRIES:
+        for idx, town in enumerate(towns, 1):
+            old_town = town[:-1] + old_suffix if old_country else None
+            items.append((country, town, f'{prefix}{idx:02d}', old_country, old_town))
+    return items
+
+
+def make_people(count, invalid_rate, rng):
+    people = []
+    for _ in range(count):
+        if rng.random() < invalid_rate:
+            uid = rng.choice([f'{rng.randint(10 ** 8, 10 ** 9 - 1)}', f'{rng.choice(UID_LETTERS)}{rng.randint(1, 9)}'
+                              f'{rng.randint(10 ** 6, 10 ** 7 - 1)}X', 'NULL'])
+        else:
+            uid = f'{rng.choice(UID_LETTERS)}{rng.choice("12")}{rng.randint(10 ** 7, 10 ** 8 - 1)}'
+        birthday = datetime(1945, 1, 1) + timedelta(days=rng.randint(0, 45 * 365))
+        people.append((uid, birthday))
+    return people
+
+
+def offences(rng, alpha=2.0, limit=30):
+    """Heavy tailed violation count of a person, most offend once."""
+    return min(int(rng.paretovariate(alpha)), limit)
+
+
+def write_workbook(path, sheets):
+    """Write sheets given as lists of (header, rows iterable) with a write only workbook."""
+    wb = Workbook(write_only=True)
+    for header, rows in sheets:
+        ws = wb.create_sheet()
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+
+def violation_rows(events, rng):
+    for uid, birthday, date in events:
+        row = [None] * 17
+        row[3] = uid
+        row[4] = birthday.strftime('%m/%d/%Y') if rng.random() < 0.6 else 'NULL'
+        row[16] = date
+        yield row
+
+
+def accident_rows(accidents, towns, rng):
+    for uid, birthday, date, hour in accidents:
+        country, town, code, old_country, old_town = rng.choice(towns)
+        if old_country and date.year < 2011 and rng.random() < 0.8:
+            country, town = old_country, old_town
+            if rng.random() < 0.5:
+                country, town = country.replace('臺', '台'), town.replace('臺', '台')
+        row = [None] * 28
+        row[0], row[1], row[2], row[3] = date, hour, country, town
+        row[6], row[7] = int(rng.random() < 0.02), rng.randint(0, 3)
+        row[10] = birthday.strftime('%m/%d/%Y') if rng.random() < 0.9 else 'NULL'
+        row[11], row[12], row[13] = rng.randint(1, 3), rng.randint(1, 2), uid
+        row[15] = birthday.strftime('%Y/%m/%d') if rng.random() < 0.97 else '0000/00/00'
+        if rng.random() < 0.7:
+            party_country, party_town, party_code, _, _ = rng.choice(towns)
+            row[17], row[18], row[19] = int(party_code), party_country, party_town
+        else:
+            row[17], row[18], row[19] = 'NULL', 'NULL', 'NULL'
+        row[21], row[22], row[23] = rng.randint(1, 3), rng.randint(1, 5), rng.randint(1, 9)
+        row[24], row[25] = int(rng.random() < 0.05), rng.randint(1, 20)
+        row[26], row[27] = rng.choice(['C03', 'B01', 'A02', 'E01']), rng.choice([1, 2, 3, 'NULL'])
+        yield row
+
+
+def region_rows(towns, rng):
+    for country, town, code, _, _ in towns:
+        yield [None, country, code, town] + [round(rng.uniform(0, 30), 2) for _ in range(10)]
+
+
+def generate(output_dir, accidents=10000, violation_files=4, invalid_rate=0.01, seed=0):
+    """Write the synthetic sources into output_dir and return their paths.
+
+    Region paths are (table, path, sheet) tuples, the country_town table is loaded from 02_old_r.xlsx.
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(output_dir, 'ObeyLaw0624'), exist_ok=True)
+    towns = country_towns()
+    people = make_people(max(accidents // 2, 1), invalid_rate, rng)
+
+    violations = []
+    for uid, birthday in people:
+        for _ in range(offences(rng)):
+            violations.append((uid, birthday, datetime(2006, 1, 1) + timedelta(days=rng.randint(0, 15 * 365))))
+    rng.shuffle(violations)
+
+    keys = set()
+    accident_events = []
+    while len(accident_events) < accidents:
+        if violations and rng.random() < 0.6:
+            # most accidents are recorded with a violation of the same day, or a few days apart
+            uid, birthday, date = rng.choice(violations)
+            date += timedelta(days=rng.choice([0, 0, 0, 0, 1, -1, 3]))
+        else:
+            uid, birthday = rng.choice(people)
+            date = datetime(2010, 1, 1) + timedelta(days=rng.randint(0, 10 * 365))
+        hour = rng.randint(0, 23)
+        if (uid, date, hour) in keys:
+            continue
+        keys.add((uid, date, hour))
+        accident_events.append((uid, birthday, date, hour))
+
+    paths = {'accident': os.path.join(output_dir, 'Accident_0701.xlsx'), 'violation': [], 'region': []}
+    write_workbook(paths['accident'], [(['header'] * 28, accident_rows(accident_events, towns, rng))])
+    size = len(violations) // violation_files + 1
+    for idx in range(violation_files):
+        path = os.path.join(output_dir, 'ObeyLaw0624', f'ObeyLaw_{idx:02d}.xlsx')
+        part = violations[idx * size:(idx + 1) * size]
+        write_workbook(path, [(['header'] * 17, violation_rows(part, rng))])
+        paths['violation'].append(path)
+    for name, tables in REGION_FILES:
+        path = os.path.join(output_dir, name)
+        write_workbook(path, [(['header'] * 14, region_rows(towns, rng)) for _ in tables])
+        paths['region'].extend((table, path, sheet) for sheet, table in enumerate(tables))
+    paths['country_town'] = os.path.join(output_dir, '02_old_r.xlsx')
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output-dir', type=str, required=True, help='Output directory.')
+    parser.add_argument('--accidents', type=int, default=10000, help='Accident row count, 10k to 10M.')
+    parser.add_argument('--violation-files', type=int, default=4, help='ObeyLaw workbooks to split violations into.')
+    parser.add_argument('--invalid-rate', type=float, default=0.01, help='Share of people with an invalid uid.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+    paths = generate(args.output_dir, args.accidents, args.violation_files, args.invalid_rate, args.seed)
+    print(paths)
+
+
+if __name__ == '__main__':
+    main()
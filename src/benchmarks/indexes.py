@@ -0,0 +1,121 @@
+"""EXPLAIN ANALYZE of the transform and export queries without and with the post load indexes.
+
+    python -m benchmarks.indexes --accidents 100000 --yes
+
+Synthetic sources are loaded into the default database, which is dropped and recreated. Every
+query runs inside a transaction that is rolled back after a VACUUM FULL, so both runs see the
+freshly loaded rows in compact tables.
+"""
+import json
+import argparse
+import tempfile
+from sqlalchemy import text
+from app.database import get_engine
+from app.database.utils import post_load_indexes, create_post_load_indexes
+from app.export import TABLES_EXPORT_SELECT_SQL
+from app.transform_sql import (
+    MATCH_VIOLATION_SQL,
+    LINK_ACCIDENT_SQL,
+    LINK_VIOLATION_SQL,
+    CREATE_MISSING_VIOLATION_SQL,
+    LINK_CREATED_VIOLATION_SQL,
+    CALCULATE_RECIDIVIST_SQL,
+)
+from .generate import generate
+from .pipeline import load_sources, append_history, git_commit, HISTORY_FILE
+
+
+# name, statements run before the explained one, explained statement
+QUERIES = [
+    ('match_violation', [], MATCH_VIOLATION_SQL),
+    ('link_accident', [MATCH_VIOLATION_SQL], LINK_ACCIDENT_SQL),
+    ('link_violation', [MATCH_VIOLATION_SQL], LINK_VIOLATION_SQL),
+    ('link_created_violation', [
+        MATCH_VIOLATION_SQL, LINK_ACCIDENT_SQL, LINK_VIOLATION_SQL, CREATE_MISSING_VIOLATION_SQL,
+    ], LINK_CREATED_VIOLATION_SQL),
+    ('calculate_recidivist', [], CALCULATE_RECIDIVIST_SQL),
+    # the uid groups read by transform.calculate_recidivist
+    ('violation_uid_groups', [], (
+        'SELECT uid, array_agg(date ORDER BY date), array_agg(id ORDER BY date) FROM violation GROUP BY uid'
+    )),
+    ('unmatched_accidents', [], 'SELECT id, uid, date FROM accident WHERE violation_id IS NULL ORDER BY uid, date'),
+    ('export', [
+        # link accidents first, the export only has matched accidents
+        MATCH_VIOLATION_SQL, LINK_ACCIDENT_SQL, 'ANALYZE accident',
+    ], TABLES_EXPORT_SELECT_SQL),
+]
+
+PARAMS = {'tolerance': 0, 'interval': 365 * 5}
+
+
+def explain(engine, setup, sql, repeat=3):
+    """Return (best execution ms of repeat runs, plan nodes) of a statement, its changes are rolled back."""
+    times = []
+    for _ in range(repeat):
+        # rolled back updates leave dead rows behind, rewrite the tables so every run starts alike
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute('VACUUM FULL ANALYZE accident, violation')
+        with engine.connect() as connection:
+            transaction = connection.begin()
+            try:
+                for statement in setup:
+                    connection.execute(text(statement), PARAMS)
+                plan = connection.execute(text(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}'), PARAMS).scalar()
+            finally:
+                transaction.rollback()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        times.append(plan[0]['Execution Time'])
+    return round(min(times), 3), plan_nodes(plan[0]['Plan'])
+
+
+def plan_nodes(node):
+    """Return the node types of a plan, e.g. 'Hash Join(Seq Scan, Hash(Seq Scan))'."""
+    name = node['Node Type']
+    if node.get('Index Name'):
+        name += f" on {node['Index Name']}"
+    children = [plan_nodes(child) for child in node.get('Plans', [])]
+    return f"{name}({', '.join(children)})" if children else name
+
+
+def run(engine):
+    results = {}
+    for name, setup, sql in QUERIES:
+        results[name] = explain(engine, setup, sql)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accidents', type=int, default=10000, help='Accident row count, 10k to 10M.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated sources.')
+    parser.add_argument('--history', type=str, default=HISTORY_FILE, help='JSON lines file the results append to.')
+    parser.add_argument('--yes', action='store_true', help='Confirm dropping the tables of the default database.')
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error('The benchmark drops and recreates the tables of the default database, confirm with --yes.')
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        load_sources(generate(data_dir, args.accidents, seed=args.seed), 'copy')
+    engine = get_engine()
+    before = run(engine)
+    create_post_load_indexes()
+    after = run(engine)
+
+    print(f"{'query':<24}{'before ms':>12}{'after ms':>12}")
+    for name, _, _ in QUERIES:
+        print(f'{name:<24}{before[name][0]:>12}{after[name][0]:>12}')
+        print(f'    before: {before[name][1]}')
+        print(f'    after:  {after[name][1]}')
+    append_history(args.history, {
+        'benchmark': 'indexes',
+        'commit': git_commit(),
+        'accidents': args.accidents,
+        'seed': args.seed,
+        'indexes': [index.name for index in post_load_indexes()],
+        'results': {name: {'before_ms': before[name][0], 'after_ms': after[name][0]} for name in before},
+    })
+
+
+if __name__ == '__main__':
+    main()
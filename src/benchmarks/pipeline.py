@@ -0,0 +1,134 @@
+"""End to end benchmark of load, transform and encrypt against the configured PostgreSQL database.
+
+    python -m benchmarks.pipeline --accidents 100000 --yes
+
+Synthetic sources from benchmarks.generate are loaded into the default database, which is
+dropped and recreated, so never point it at real data. Every run appends one JSON line with the
+scale, the commit and the seconds of each scenario to the history file, to compare runs over time.
+"""
+import os
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+from datetime import datetime
+from contextlib import contextmanager
+from app.database import utils
+from app.loader import get_loader, load_files, encrypt_uid_and_save_file, stream_encrypt_uid_and_save_file
+from app import transform, transform_sql
+from app.hashing import uid_hasher
+from manage import TRANSFORM_STEPS
+from .generate import generate
+
+
+SCENARIOS = ['load.orm', 'load.copy', 'transform.python', 'transform.sql', 'encrypt.memory', 'encrypt.streaming']
+
+HISTORY_FILE = os.path.join(os.path.dirname(__file__), 'results', 'history.jsonl')
+
+
+@contextmanager
+def timed(results, name):
+    start = time.perf_counter()
+    yield
+    results[name] = round(time.perf_counter() - start, 3)
+    print(f'{name}: {results[name]}s')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_sources(paths, mode, results=None, prefix='load'):
+    """Recreate the tables and load every source with the given mode."""
+    results = {} if results is None else results
+    utils.init_database(drop_all=True)
+    tables = [('country_town', [paths['country_town']], 0)]
+    tables += [(table, [path], sheet) for table, path, sheet in paths['region']]
+    tables += [('accident', [paths['accident']], 0), ('violation', paths['violation'], 0)]
+    for table, file_paths, sheet in tables:
+        loader = get_loader(table, mode=mode, rejects='jsonl')
+        with timed(results, f'{prefix}.{table}'):
+            load_files(file_paths, loader, sheet=sheet, processes=1)
+    return results
+
+
+def run_transform(module, results, prefix):
+    uid_hasher.clear()
+    for step in TRANSFORM_STEPS:
+        with timed(results, f'{prefix}.{step}'):
+            getattr(module, step)()
+
+
+def run(paths, scenarios):
+    results = {}
+    if 'load.orm' in scenarios:
+        with timed(results, 'load.orm'):
+            load_sources(paths, 'orm', results, 'load.orm')
+    if 'load.copy' in scenarios:
+        with timed(results, 'load.copy'):
+            load_sources(paths, 'copy', results, 'load.copy')
+    for engine, module in [('python', transform), ('sql', transform_sql)]:
+        name = f'transform.{engine}'
+        if name not in scenarios:
+            continue
+        # each engine starts from freshly loaded sources
+        load_sources(paths, 'copy')
+        with timed(results, name):
+            run_transform(module, results, name)
+    with tempfile.TemporaryDirectory() as output_dir:
+        if 'encrypt.memory' in scenarios:
+            uid_hasher.clear()
+            with timed(results, 'encrypt.memory'):
+                encrypt_uid_and_save_file(paths['accident'], 13, output_dir)
+        if 'encrypt.streaming' in scenarios:
+            uid_hasher.clear()
+            with timed(results, 'encrypt.streaming'):
+                stream_encrypt_uid_and_save_file(paths['accident'], 13, output_dir)
+    return results
+
+
+def append_history(path, record):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accidents', type=int, default=10000, help='Accident row count, 10k to 10M.')
+    parser.add_argument('--violation-files', type=int, default=4, help='ObeyLaw workbooks to split violations into.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated sources.')
+    parser.add_argument('--data-dir', type=str, default=None,
+                        help='Keep the generated sources in this directory, default to a temporary one.')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS, help='Scenarios to run.')
+    parser.add_argument('--history', type=str, default=HISTORY_FILE, help='JSON lines file the results append to.')
+    parser.add_argument('--yes', action='store_true', help='Confirm dropping the tables of the default database.')
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error('The benchmark drops and recreates the tables of the default database, confirm with --yes.')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        start = time.perf_counter()
+        paths = generate(data_dir, args.accidents, args.violation_files, seed=args.seed)
+        print(f'generate: {time.perf_counter() - start:.3f}s')
+        results = run(paths, args.scenarios)
+
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'accidents': args.accidents,
+        'violation_files': args.violation_files,
+        'seed': args.seed,
+        'results': results,
+    }
+    append_history(args.history, record)
+    print(f'History: {args.history}')
+
+
+if __name__ == '__main__':
+    main()
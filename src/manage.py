@@ -1,101 +1,333 @@
+import os
 import json
 import argparse
 from functools import partial
-from app import settings
-from app.database import utils
-from app.database import models
-from app.loader import (
-    load_data,
-    violation_row_to_instance,
-    accident_row_to_instance,
-    region_data_to_instances,
-    country_town_data_to_instances,
-    encrypt_uid_and_save_file
-)
-from app.transform import (
-    patch_party_address_from_accident,
-    patch_birthday_from_violation,
-    patch_missing_violation,
-    calculate_recidivist,
-    calculate_age,
-    encrypt_uid,
-)
+
+
+# transform steps in pipeline order with the tables they read and write, steps without
+# conflicting tables may run concurrently, see app.scheduler
+TRANSFORM_STEPS = {
+    # 'patch_birthday_from_violation': {'reads': ['accident', 'violation'], 'writes': ['accident']},
+    'patch_party_address_from_accident': {
+        'reads': ['accident', 'country_town', 'address_alias'], 'writes': ['accident', 'address_alias'],
+    },
+    'patch_missing_violation': {'reads': ['accident', 'violation'], 'writes': ['accident', 'violation']},
+    'calculate_recidivist': {'reads': ['violation'], 'writes': ['violation']},
+    'calculate_age': {'reads': ['accident'], 'writes': ['accident']},
+    # hashes the uids the other steps match on, so it comes last
+    'encrypt_uid': {'reads': ['accident', 'violation'], 'writes': ['accident', 'violation']},
+}
+
+SERVER_SIDE_STEPS = [
+    'patch_party_address_from_accident',
+    'patch_missing_violation',
+    'calculate_recidivist',
+    'calculate_age',
+    'encrypt_uid',
+]
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
-    parser.add_argument('action', choices=['init', 'describe', 'load', 'transform', 'encrypt'], default='describe',
+    parser.add_argument('action', choices=COMMANDS.keys(), default='describe',
                         help='Command line argument.')
-    parser.add_argument('--db', choices=settings.DATABASES.keys(), default='default',
-                        help='Database declared from settings.')
+    parser.add_argument('--db', type=str, default='default', help='Database declared from settings.')
+    parser.add_argument('--post-load', action='store_true',
+                        help='With init, build the indexes of the transform queries, analyze and rebuild the address aliases once loaded.')
+    parser.add_argument('--partition-by-year', action='store_true',
+                        help='With init, create accident and violation range partitioned by year of date.')
     parser.add_argument('--table', type=str, default=None, help='Table name.')
-    parser.add_argument('--file', type=str, default=None, help='File path.')
+    parser.add_argument('--file', type=str, default=None, help='File path, glob pattern or directory.')
+    parser.add_argument('--files', nargs='+', default=[],
+                        help='Batch of inputs handled by one process, each as [TABLE=]PATH[#SHEET] where PATH may be '
+                             'a glob pattern or directory, TABLE and SHEET default to --table and --sheet.')
     parser.add_argument('--sheet', type=int, default=0, help='Sheet No.')
+    parser.add_argument('--year', type=int, default=None,
+                        help='With load, truncate the year partition and load only the rows dated in that year. '
+                             'With partition, the year partition to alter.')
+    parser.add_argument('--detach', action='store_true', help='With partition, detach the year partition.')
+    parser.add_argument('--attach', action='store_true', help='With partition, attach a detached year partition.')
+    parser.add_argument('--truncate', action='store_true', help='With partition, delete the rows of the year.')
+    parser.add_argument('--mode', choices=['orm', 'copy'], default='orm',
+                        help='Load through ORM bulk inserts or PostgreSQL COPY.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Skip files unchanged since the last load and replace rows of changed files.')
+    parser.add_argument('--queue-depth', type=int, default=0,
+                        help='Parsed chunks buffered for writer threads, 0 parses and writes serially.')
+    parser.add_argument('--writers', type=int, default=1, help='Writer threads of the load pipeline.')
+    parser.add_argument('--rejects', choices=['jsonl', 'csv', 'print'], default='jsonl',
+                        help='Write rejected rows to a file per source in REJECTS_DIR, or print them.')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Worker processes for loading multiple files, default to cpu count.')
+    parser.add_argument('--server-side', nargs='+', choices=SERVER_SIDE_STEPS + ['all'], default=[],
+                        help='Transform steps executed as set based SQL inside the database.')
+    parser.add_argument('--steps', nargs='+', choices=TRANSFORM_STEPS.keys(), default=list(TRANSFORM_STEPS),
+                        help='Subset of the transform steps to run, in pipeline order.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the transform steps finished by the previous run and continue the '
+                             'interrupted one from its last checkpoint.')
+    parser.add_argument('--step-workers', type=int, default=1,
+                        help='Transform steps run concurrently once the steps they depend on are done.')
+    parser.add_argument('--tolerance', type=int, default=0,
+                        help='Max days between the dates of an accident and its violation.')
+    parser.add_argument('--recidivist-interval', type=int, default=365 * 5,
+                        help='Max days between two violations of a recidivist.')
     parser.add_argument('--output-dir', type=str, default=None, help='Output directory.')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Encrypt workbooks row by row with constant memory.')
+    parser.add_argument('--output-format', choices=['xlsx', 'csv'], default='xlsx',
+                        help='Output format of encrypted files, csv implies streaming.')
+    parser.add_argument('--refresh', action='store_true', help='Recompute the export view before writing it.')
+    parser.add_argument('--rebuild', action='store_true', help='Drop and recreate the export view.')
+    parser.add_argument('--indicator', action='store_true',
+                        help='Join the rates of the region_indicator table in the export view, with --rebuild.')
+    parser.add_argument('--split-by-year', action='store_true', help='Write one export file per accident year.')
+    parser.add_argument('--report', type=str, default=None, help='With validate, write the JSON quality report to this path.')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Write a JSON report of stage timings, throughput and statement counts to this path.')
+    parser.add_argument('--cprofile', type=str, default=None, help='Write a cProfile dump to this path.')
     args = parser.parse_args()
     return args
 
 
+def get_inputs(args):
+    """Return (table, sheet, path) of --file and every --files entry."""
+    inputs = []
+    if args.file:
+        inputs.append((args.table, args.sheet, args.file))
+    for spec in args.files:
+        table, sep, path = spec.partition('=')
+        if not sep:
+            table, path = args.table, spec
+        path, sep, sheet = path.partition('#')
+        inputs.append((table, int(sheet) if sep else args.sheet, path))
+    if not inputs:
+        raise argparse.ArgumentTypeError('Argument --file or --files is missing.')
+    for table, _, path in inputs:
+        if not table:
+            raise argparse.ArgumentTypeError(f'Argument --table is missing for {path}.')
+    return inputs
+
+
+def init_command(args):
+    from app.database import utils
+    if args.post_load:
+        from app.address import build_address_aliases
+        utils.create_post_load_indexes(args.db)
+        with utils.session_scope(args.db) as s:
+            build_address_aliases(s)
+        print('OK')
+        return
+    confirm_msg = (
+        f"Do you want to drop tables in {args.db} database before recreate them? (y/n)"
+    )
+    drop = input(confirm_msg).lower() == "y"
+    try:
+        utils.init_database(args.db, drop, partition_by_year=args.partition_by_year)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    print('OK')
+
+
+def describe_command(args):
+    if not args.table:
+        raise argparse.ArgumentTypeError('Argument --table is missing.')
+    from app.database import utils
+    result = utils.describe_table(args.table, args.db)
+    json_result = json.dumps(result, indent=4, default=str)
+    print(json_result)
+
+
+def load_command(args):
+    inputs = get_inputs(args)
+    if args.year is not None and args.incremental:
+        raise argparse.ArgumentTypeError('Argument --year reloads a year, it cannot be incremental.')
+    from app.loader import get_loader, load_region_indicator, expand_file_paths, load_files, print_load_summary
+    rejects = None if args.rejects == 'print' else args.rejects
+    if args.year is not None:
+        from app.partition import is_partitioned, ensure_partitions, truncate_partition
+        for table in sorted({table for table, _, _ in inputs}):
+            if not is_partitioned(table):
+                raise argparse.ArgumentTypeError(f'Table {table} is not partitioned by year.')
+            try:
+                ensure_partitions(table, [args.year])
+                truncate_partition(table, args.year)
+            except ValueError as e:
+                raise argparse.ArgumentTypeError(str(e))
+    summaries = []
+    for table, sheet, path in inputs:
+        if table == 'region_indicator':
+            if not os.path.isdir(path):
+                raise argparse.ArgumentTypeError('The region_indicator input must be the directory of the region workbooks.')
+            summaries += load_region_indicator(path, rejects=rejects)
+            continue
+        try:
+            loader = get_loader(table, mode=args.mode, incremental=args.incremental,
+                                queue_depth=args.queue_depth, writers=args.writers, rejects=rejects, year=args.year)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+        file_paths = expand_file_paths(path)
+        if not file_paths:
+            raise argparse.ArgumentTypeError(f'No file matches {path}.')
+        summaries += load_files(file_paths, loader, sheet=sheet, processes=args.processes)
+    print_load_summary(summaries)
+
+
+def partition_command(args):
+    from app import partition
+    actions = [action for action in ('detach', 'attach', 'truncate') if getattr(args, action)]
+    if len(actions) > 1:
+        raise argparse.ArgumentTypeError('Choose one of --detach, --attach and --truncate.')
+    if actions:
+        if args.year is None:
+            raise argparse.ArgumentTypeError('Argument --year is missing.')
+        tables = [args.table] if args.table else partition.PARTITIONED_TABLES
+        for table in tables:
+            try:
+                getattr(partition, f'{actions[0]}_partition')(table, args.year, args.db)
+            except ValueError as e:
+                raise argparse.ArgumentTypeError(str(e))
+    for table, year, attached, count in partition.list_partitions(args.db):
+        print(f"table={table} | year={year} | {'attached' if attached else 'detached'} | rows={count}")
+
+
+def validate_command(args):
+    inputs = get_inputs(args)
+    from app.loader import expand_file_paths
+    from app.validate import validate_files, print_validation_report
+    reports = []
+    for table, sheet, path in inputs:
+        file_paths = expand_file_paths(path)
+        if not file_paths:
+            raise argparse.ArgumentTypeError(f'No file matches {path}.')
+        try:
+            reports += validate_files(file_paths, table, sheet=sheet, processes=args.processes)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    print_validation_report(reports)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=4, ensure_ascii=False)
+        print(f'Quality report: {args.report}')
+
+
+def stage_command(args):
+    inputs = get_inputs(args)
+    from app.loader import stage_data, expand_file_paths
+    for table, sheet, path in inputs:
+        for file_path in expand_file_paths(path):
+            summary = stage_data(file_path, table, sheet=sheet,
+                                 rejects=None if args.rejects == 'print' else args.rejects)
+            print(f"file={summary['file']} | staged={summary['staged']} | rows={summary['rows']} | "
+                  f"rejected={summary['rejected']}")
+            for reason, count in summary.get('reasons', {}).items():
+                print(f'{reason}: {count}')
+
+
+def transform_command(args):
+    from app import transform, transform_sql
+    from app.checkpoint import run_step
+    from app.scheduler import run_steps, critical_path
+    from app.instrument import profiler
+    server_side = SERVER_SIDE_STEPS if 'all' in args.server_side else args.server_side
+    step_options = {
+        'patch_missing_violation': {'tolerance': args.tolerance},
+        'calculate_recidivist': {'interval': args.recidivist_interval},
+    }
+    steps = {step: tables for step, tables in TRANSFORM_STEPS.items() if step in args.steps}
+
+    def run(step):
+        module = transform_sql if step in server_side else transform
+        with profiler.stage(f'transform.{step}'):
+            run_step(step, getattr(module, step), resume=args.resume, **step_options.get(step, {}))
+
+    timings = run_steps(steps, run, workers=args.step_workers)
+    path, seconds = critical_path(steps, timings)
+    wall = max(end for _, end in timings.values()) if timings else 0.0
+    print(f"Critical path: {' -> '.join(f'{step} {timings[step][1] - timings[step][0]:.2f}s' for step in path)}, "
+          f"{seconds:.2f}s of {wall:.2f}s wall time "
+          f"and {sum(end - start for start, end in timings.values()):.2f}s of step time.")
+
+
+def encrypt_command(args):
+    inputs = get_inputs(args)
+    if not args.output_dir:
+        raise argparse.ArgumentTypeError('Argument --output-dir is missing.')
+    from app.loader import expand_file_paths, encrypt_uid_and_save_file, stream_encrypt_uid_and_save_file
+    from app.hashing import uid_hasher
+    if args.streaming or args.output_format == 'csv':
+        encrypt_file = partial(stream_encrypt_uid_and_save_file, output_format=args.output_format)
+    else:
+        encrypt_file = encrypt_uid_and_save_file
+    column_indexes = {'violation': 3, 'accident': 13}
+    for table, sheet, path in inputs:
+        if table not in column_indexes:
+            raise argparse.ArgumentTypeError(f'Unknown table {table}.')
+        for file_path in expand_file_paths(path):
+            encrypt_file(file_path, column_indexes[table], args.output_dir, sheet=sheet)
+    print(f'Uid hash cache: {uid_hasher.stats()}')
+
+
+def export_command(args):
+    if not args.output_dir:
+        raise argparse.ArgumentTypeError('Argument --output-dir is missing.')
+    from app import export
+    from app.instrument import profiler
+    with profiler.stage('export.create'):
+        export.create_export(args.db, rebuild=args.rebuild, indicator=args.indicator)
+    if args.refresh or args.rebuild or not export.is_export_populated(args.db):
+        with profiler.stage('export.refresh'):
+            export.refresh_export(args.db)
+    with profiler.stage('export.copy'):
+        counts = export.copy_export(args.output_dir, args.db, split_by_year=args.split_by_year)
+    for path, count in counts.items():
+        print(f'file={path} | rows={count}')
+
+
+# every command imports what it needs, so trivial commands start without loading the app
+COMMANDS = {
+    'init': init_command,
+    'describe': describe_command,
+    'load': load_command,
+    'partition': partition_command,
+    'stage': stage_command,
+    'validate': validate_command,
+    'transform': transform_command,
+    'encrypt': encrypt_command,
+    'export': export_command,
+}
+
+
+def run(args):
+    from app import settings
+    if args.db not in settings.DATABASES:
+        raise argparse.ArgumentTypeError(f"Database {args.db} is not declared in settings.")
+    COMMANDS[args.action](args)
+
+
 def main():
     args = parse_arguments()
-    if args.action == 'init':
-        confirm_msg = (
-            f"Do you want to drop tables in {args.db} database before recreate them? (y/n)"
-        )
-        drop = input(confirm_msg).lower() == "y"
-        utils.init_database(args.db, drop)
-        print('OK')
-    if args.action == 'describe':
-        if not args.table:
-            raise argparse.ArgumentTypeError('Argument --table is missing.')
-        result = utils.describe_table(args.table, args.db)
-        json_result = json.dumps(result, indent=4, default=str)
-        print(json_result)
-
-    if args.action == 'load':
-        for arg in ['table', 'file']:
-            if not getattr(args, arg):
-                raise argparse.ArgumentTypeError(f'Argument --{arg} is missing.')
-        if args.table == 'violation':
-            load_data(args.file, hook=violation_row_to_instance)
-        elif args.table == 'accident':
-            load_data(args.file, hook=accident_row_to_instance)
-        elif args.table == 'country_town':
-            load_data(args.file, hook=country_town_data_to_instances)
-        elif args.table in ('divorce', 'old', 'indigenous', 'education', 'income_mid', 'income_avg'):
-            mapping = {
-                idx: year for idx, year in zip(range(4, 14), range(2010, 2021))
-            }
-            model_classes = {
-                'divorce': models.Divorce,
-                'old': models.Old,
-                'indigenous': models.Indigenous,
-                'education': models.Education,
-                'income_mid': models.IncomeMid,
-                'income_avg': models.IncomeAvg
-            }
-            load_data(args.file, sheet=args.sheet, hook=partial(
-                region_data_to_instances, mapping=mapping, model_class=model_classes.get(args.table)
-            ))
-        else:
-            raise argparse.ArgumentError(f'Unknown table {arg.table}.')
-
-    if args.action == 'transform':
-        # patch_birthday_from_violation()
-        patch_party_address_from_accident()
-        patch_missing_violation()
-        calculate_recidivist()
-        calculate_age()
-        encrypt_uid()
-
-    if args.action == 'encrypt':
-        for arg in ['table', 'file', 'output_dir']:
-            if not getattr(args, arg):
-                raise argparse.ArgumentTypeError(f'Argument --{arg} is missing.')
-        if args.table == 'violation':
-            encrypt_uid_and_save_file(args.file, 3, args.output_dir)
-        elif args.table == 'accident':
-            encrypt_uid_and_save_file(args.file, 13, args.output_dir)
+    from app.instrument import profiler
+    if args.profile:
+        from sqlalchemy.engine import Engine
+        # listen on the class, engines are created on first use
+        profiler.enable([Engine])
+    cprofile = None
+    if args.cprofile:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    try:
+        with profiler.stage(args.action):
+            run(args)
+    finally:
+        if cprofile:
+            cprofile.disable()
+            cprofile.dump_stats(args.cprofile)
+            print(f'cProfile dump: {args.cprofile}')
+        if args.profile:
+            profiler.dump(args.profile)
+            print(f'Profile report: {args.profile}')
 
 
 if __name__ == '__main__':
@@ -11,8 +11,5 @@ VIOLATION_DIR="$OUTPUT_DIR/Violation"
 
 mkdir -p "$VIOLATION_DIR"
 
-python manage.py encrypt --table="accident" --file="/data/Accident_0701.xlsx" --output-dir="$OUTPUT_DIR"
-
-for filename in /data/ObeyLaw0624/*.xlsx; do
-  python manage.py encrypt --table="violation" --file="$filename" --output-dir="$VIOLATION_DIR"
-done
\ No newline at end of file
+python manage.py encrypt --table="accident" --file="/data/Accident_0701.xlsx" --output-dir="$OUTPUT_DIR" --streaming
+python manage.py encrypt --table="violation" --file="/data/ObeyLaw0624/*.xlsx" --output-dir="$VIOLATION_DIR" --streaming
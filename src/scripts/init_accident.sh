@@ -6,4 +6,4 @@ cat /dev/null > "$LOG_FILE" && chmod 777 "$LOG_FILE"
 
 exec 1> "$LOG_FILE"
 
-python manage.py load --table="accident" --file="/data/Accident_0701.xlsx"
\ No newline at end of file
+python manage.py load --table="accident" --file="/data/Accident_0701.xlsx" --incremental
\ No newline at end of file
@@ -17,9 +17,10 @@ with utils.session_scope() as s:
   s.execute("TRUNCATE TABLE income_avg;")
 END
 
-python manage.py load --table="divorce" --file="/data/01_divorce_r.xlsx"
-python manage.py load --table="old" --file="/data/02_old_r.xlsx"
-python manage.py load --table="indigenous" --file="/data/03_Indgnus_r.xlsx"
-python manage.py load --table="education" --file="/data/04_highedu_r.xlsx"
-python manage.py load --table="income_mid" --file="/data/05_income_r.xlsx"
-python manage.py load --table="income_avg" --file="/data/05_income_r.xlsx" --sheet=1
+python manage.py load --files \
+  divorce="/data/01_divorce_r.xlsx" \
+  old="/data/02_old_r.xlsx" \
+  indigenous="/data/03_Indgnus_r.xlsx" \
+  education="/data/04_highedu_r.xlsx" \
+  income_mid="/data/05_income_r.xlsx" \
+  income_avg="/data/05_income_r.xlsx#1"
@@ -0,0 +1,9 @@
+#! /bin/sh
+
+LOG_FILE="$0.$$.log"
+
+cat /dev/null > "$LOG_FILE" && chmod 777 "$LOG_FILE"
+
+exec 1> "$LOG_FILE"
+
+python manage.py load --table="region_indicator" --file="/data"